@@ -1,16 +1,66 @@
-from django.contrib.admin import ModelAdmin, site, TabularInline
+from django.contrib.admin import (ModelAdmin, SimpleListFilter, site,
+                                  TabularInline)
 
 from recipes.models import (Ingredient, Favorite, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
 from users.models import CustomUser, Subscribe
 
 
+class InputFilter(SimpleListFilter):
+    """
+    Фильтр с полем ввода вместо списка всех значений: на больших
+    таблицах боковая панель не перечисляет всех пользователей
+    """
+
+    template = 'admin/input_filter.html'
+    field_path = None
+
+    def lookups(self, request, model_admin):
+        return ((None, None),)
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value:
+            return queryset.filter(**{self.field_path: value.strip()})
+        return queryset
+
+    def choices(self, changelist):
+        query_params = [
+            (name, value)
+            for name, value in changelist.params.items()
+            if name != self.parameter_name
+        ]
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'query_params': query_params,
+            'reset_query_string': changelist.get_query_string(
+                remove=[self.parameter_name]),
+        }
+
+
+class AuthorFilter(InputFilter):
+    title = 'автору (username)'
+    parameter_name = 'author'
+    field_path = 'author__username'
+
+
+class UserFilter(InputFilter):
+    title = 'пользователю (username)'
+    parameter_name = 'user'
+    field_path = 'user__username'
+
+
 class UserAdmin(ModelAdmin):
     list_display = ('pk', 'username', 'email', 'first_name',
-                    'last_name', 'date_joined')
+                    'last_name', 'date_joined', 'recipes_count')
     list_display_links = ('pk', 'username', 'email')
-    search_fields = ('username',)
-    list_filter = ('username', 'email')
+    # Поиск по началу строки с учетом регистра: на PostgreSQL его
+    # обслуживают индексы varchar_pattern_ops, а UPPER(...) LIKE от
+    # istartswith (префикс ^) - нет
+    search_fields = ('username__startswith', 'email__startswith')
+    list_filter = ('is_staff', 'is_active')
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
@@ -25,65 +75,83 @@ class TagAdmin(ModelAdmin):
 class IngredientAdmin(ModelAdmin):
     list_display = ('pk', 'name', 'measurement_unit')
     list_display_links = ('pk', 'name',)
-    search_fields = ('name',)
+    search_fields = ('name__startswith',)
     list_editable = ('measurement_unit',)
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
-class IngredientInline(TabularInline):
-    model = Ingredient
-    fields = ('name', 'measurement_unit')
-
-
 class RecipeIngredientAdmin(ModelAdmin):
-    list_display = ('recipe', 'ingredient', 'amount')
-    list_display_links = ('recipe', 'ingredient')
-    inlines = [
-        IngredientInline
-    ]
+    list_display = ('pk', 'recipe', 'ingredient', 'amount')
+    list_display_links = ('pk', 'recipe')
+    list_select_related = ('recipe', 'ingredient')
+    search_fields = ('recipe__name__startswith',)
+    autocomplete_fields = ('recipe', 'ingredient')
+    show_full_result_count = False
 
 
 class RecipeIngredientInline(TabularInline):
     model = RecipeIngredient
     autocomplete_fields = ('ingredient',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
 
 class RecipeAdmin(ModelAdmin):
-    list_display = ('pk', 'name', 'text', 'cooking_time',
+    list_display = ('pk', 'name', 'author', 'text', 'cooking_time',
                     'pub_date', 'add_to_favorites')
     list_display_links = ('pk', 'name')
-    search_fields = ('name',)
+    list_select_related = ('author',)
+    search_fields = ('name__startswith',)
     inlines = [
         RecipeIngredientInline,
     ]
     autocomplete_fields = ('author', 'tags')
-    list_filter = ('author', 'tags')
+    list_filter = (AuthorFilter, 'tags')
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
     def add_to_favorites(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
+    add_to_favorites.short_description = 'В избранном'
+    add_to_favorites.admin_order_field = 'favorites_count'
 
 
 class FavoriteAdmin(ModelAdmin):
     list_display = ('pk', 'user', 'recipe')
     list_display_links = ('pk', 'user')
+    list_select_related = ('user', 'recipe')
+    list_filter = (UserFilter,)
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 class ShoppingCartAdmin(ModelAdmin):
     list_display = ('pk', 'user', 'recipe')
     list_display_links = ('pk', 'user')
+    list_select_related = ('user', 'recipe')
+    list_filter = (UserFilter,)
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 class SubscribeAdmin(ModelAdmin):
     list_display = ('pk', 'user', 'author')
     list_display_links = ('pk', 'user')
-    search_fields = ('user', 'author')
+    list_select_related = ('user', 'author')
+    search_fields = ('user__username__startswith',
+                     'author__username__startswith')
+    list_filter = (UserFilter, AuthorFilter)
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
 
 
 site.register(CustomUser, UserAdmin)
 site.register(Tag, TagAdmin)
 site.register(Ingredient, IngredientAdmin)
 site.register(Recipe, RecipeAdmin)
+site.register(RecipeIngredient, RecipeIngredientAdmin)
 site.register(Favorite, FavoriteAdmin)
 site.register(ShoppingCart, ShoppingCartAdmin)
 site.register(Subscribe, SubscribeAdmin)
@@ -0,0 +1,145 @@
+import hashlib
+import time
+from http import HTTPStatus
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from recipes.models import Tag
+
+CACHE_PREFIX = 'foodgram'
+RECIPES_GENERATION = 'recipes'
+REFERENCE_GENERATION = 'reference'
+TAGS_GENERATION = 'tags'
+INGREDIENTS_GENERATION = 'ingredients'
+IMAGE_VARIANT_PARAMS = ('image_variant', 'image_format')
+RECIPE_LIST_PARAMS = (
+    'author', 'page', 'recipes_limit', 'cursor', 'tags_match',
+    *IMAGE_VARIANT_PARAMS)
+
+
+def generation_key(name):
+    return f'{CACHE_PREFIX}:gen:{name}'
+
+
+def recipe_generation(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_generation(user_id):
+    return f'user:{user_id}'
+
+
+def _initial_generation():
+    """
+    Начальное значение счетчика - текущее время в мс: если счетчик
+    был вытеснен из кэша, он не вернется к уже использованному значению
+    """
+
+    return int(time.time() * 1000)
+
+
+def get_generations(*names):
+    """Текущие значения счетчиков поколений одним обращением к кэшу"""
+
+    keys = [generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _initial_generation(), None)
+            values[key] = cache.get(key, _initial_generation())
+    return [values[key] for key in keys]
+
+
+def bump_generations(*names):
+    """Инвалидация: увеличиваем счетчики, старые ключи просто устаревают"""
+
+    for name in names:
+        key = generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_generation(), None)
+
+
+def cache_period():
+    """
+    Номер текущего интервала RECIPES_CACHE_TIMEOUT: ETag ленты меняется
+    не реже, чем истекает ее кэш, вместе с ним обновляются и счетчики
+    """
+
+    return int(time.time() // settings.RECIPES_CACHE_TIMEOUT)
+
+
+def viewer_generation(user):
+    """Версия пользовательских данных: избранное, корзина, подписки"""
+
+    if user.is_anonymous:
+        return 'anonymous'
+    generation, = get_generations(user_generation(user.id))
+    return f'{user.id}:{generation}'
+
+
+def get_tag_ids_by_slug():
+    """Словарь slug -> id тегов, хранится в кэше до изменения тегов"""
+
+    generation, = get_generations(TAGS_GENERATION)
+    return cache.get_or_set(
+        f'{CACHE_PREFIX}:tags:slugs:{generation}',
+        lambda: dict(Tag.objects.values_list('slug', 'id')),
+        None
+    )
+
+
+def make_etag(*parts):
+    """
+    Слабый ETag из версий данных, от которых зависит ответ: сжатое
+    и несжатое представления одного ответа различаются побайтно
+    """
+
+    value = '|'.join(str(part) for part in parts)
+    return 'W/"{}"'.format(hashlib.md5(value.encode()).hexdigest())
+
+
+def request_origin(request):
+    """
+    Схема и хост запроса: ссылки на страницы и изображения в ответе
+    абсолютные, ответ для одного хоста нельзя отдавать другому
+    """
+
+    return request.build_absolute_uri('/')
+
+
+def recipe_list_cache_key(request):
+    """Ключ списка рецептов по нормализованным параметрам запроса"""
+
+    params = request.query_params
+    parts = ['tags=' + ','.join(sorted(set(params.getlist('tags'))))]
+    parts += [f'{name}={params.get(name, "")}' for name in RECIPE_LIST_PARAMS]
+    generation, = get_generations(RECIPES_GENERATION)
+    return (f'{CACHE_PREFIX}:recipes:list:{generation}:{cache_period()}:'
+            f'{request_origin(request)}:{"&".join(parts)}')
+
+
+def recipe_detail_cache_key(request, recipe_id):
+    """Ключ рецепта по id с учетом поколения справочников и рецепта"""
+
+    params = request.query_params
+    variant = ':'.join(params.get(name, '') for name in IMAGE_VARIANT_PARAMS)
+    reference, recipe = get_generations(
+        REFERENCE_GENERATION, recipe_generation(recipe_id))
+    return (f'{CACHE_PREFIX}:recipes:detail:{reference}:{recipe}:'
+            f'{request_origin(request)}:{recipe_id}:{variant}')
+
+
+def cached_response(key, get_response):
+    """Ответ из кэша, либо ответ view с сохранением данных в кэш"""
+
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+    response = get_response()
+    if response.status_code == HTTPStatus.OK:
+        cache.set(key, response.data, settings.RECIPES_CACHE_TIMEOUT)
+    return response
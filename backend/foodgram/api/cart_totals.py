@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingCartTotal
+from users.models import CustomUser
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента рецепта: {ingredient_id: amount}"""
+
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+
+def recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов"""
+
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids).values_list('ingredient_id').annotate(
+            total=Sum('amount')).order_by())
+
+
+def amounts_delta(old, new):
+    """Изменение количеств ингредиентов между двумя версиями рецепта"""
+
+    return {
+        ingredient_id: new.get(ingredient_id, 0) - old.get(ingredient_id, 0)
+        for ingredient_id in {*old, *new}
+    }
+
+
+def negate(amounts):
+    return {
+        ingredient_id: -amount for ingredient_id, amount in amounts.items()
+    }
+
+
+def cart_user_ids(recipe_id):
+    return list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+
+
+@transaction.atomic
+def apply_cart_deltas(user_ids, deltas):
+    """
+    Прибавляет deltas к итогам корзин пользователей user_ids:
+    недостающие строки создаются, обнулившиеся удаляются.
+    Строки пользователей блокируются, чтобы параллельные
+    изменения одной корзины не теряли друг друга
+    """
+
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+    list(CustomUser.objects.select_for_update().filter(
+        pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+    existing = {
+        (total.user_id, total.ingredient_id): total
+        for total in ShoppingCartTotal.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, delta in deltas.items():
+            total = existing.get((user_id, ingredient_id))
+            if total is None:
+                if delta > 0:
+                    to_create.append(ShoppingCartTotal(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total=delta
+                    ))
+                continue
+            total.total += delta
+            if total.total > 0:
+                to_update.append(total)
+            else:
+                to_delete.append(total.pk)
+    ShoppingCartTotal.objects.bulk_create(to_create)
+    ShoppingCartTotal.objects.bulk_update(to_update, ['total'])
+    ShoppingCartTotal.objects.filter(pk__in=to_delete).delete()
+
+
+def add_recipes_to_cart_totals(user_id, recipe_ids):
+    apply_cart_deltas([user_id], recipes_amounts(recipe_ids))
+
+
+def remove_recipes_from_cart_totals(user_id, recipe_ids):
+    apply_cart_deltas([user_id], negate(recipes_amounts(recipe_ids)))
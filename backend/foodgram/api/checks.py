@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_shared_default_cache(app_configs, **kwargs):
+    """
+    Поколения кэша в памяти процесса не видны другим воркерам:
+    после изменения данных они продолжают отдавать старые ответы
+    """
+
+    if settings.DEBUG or not isinstance(caches['default'], LocMemCache):
+        return []
+    return [
+        Warning(
+            'Кэш default хранится в памяти процесса.',
+            hint=('При нескольких воркерах задайте общий кэш, например '
+                  'CACHE_BACKEND=django_redis.cache.RedisCache.'),
+            id='api.W001',
+        )
+    ]
@@ -0,0 +1,38 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import CustomUser
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+
+def change_counter(queryset, field, delta):
+    """Атомарное изменение счетчика одним UPDATE, без ухода ниже нуля"""
+
+    return queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def change_recipe_counter(model, recipe_ids, delta):
+    """Счетчик избранного или корзин (model) у рецептов recipe_ids"""
+
+    return change_counter(
+        Recipe.objects.filter(pk__in=recipe_ids),
+        RECIPE_COUNTERS[model],
+        delta
+    )
+
+
+def change_recipes_count(author_id, delta):
+    return change_counter(
+        CustomUser.objects.filter(pk=author_id), 'recipes_count', delta)
+
+
+def change_ingredients_version(recipe_id):
+    """Новая версия ингредиентов рецепта для отпечатка корзины"""
+
+    return change_counter(
+        Recipe.objects.filter(pk=recipe_id), 'ingredients_version', 1)
@@ -1,28 +1,50 @@
+from django.db.models import Count
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from api.cache import get_tag_ids_by_slug
+from recipes.models import Recipe
 
+TAGS_MATCH_ANY = 'any'
+TAGS_MATCH_ALL = 'all'
 
-class IngredientFilter(filters.FilterSet):
-    """Кастомная регистронезависимая фильтрация по имени"""
 
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
+def tag_slug_choices():
+    return [(slug, slug) for slug in get_tag_ids_by_slug()]
 
 
 class RecipeFilter(filters.FilterSet):
-    """Кастомная система фильтрации по тегам и авторам"""
-
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    """
+    Кастомная система фильтрации по тегам и авторам.
+    Теги проверяются по закэшированному словарю слагов, рецепты
+    отбираются подзапросом по связующей таблице без JOIN и DISTINCT:
+    tags_match=any - хотя бы один из тегов, all - все теги сразу
+    """
+
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_slug_choices,
+        method='filter_tags'
+    )
+    tags_match = filters.ChoiceFilter(
+        choices=((TAGS_MATCH_ANY, TAGS_MATCH_ANY),
+                 (TAGS_MATCH_ALL, TAGS_MATCH_ALL)),
+        method='filter_tags_match'
     )
     author = filters.NumberFilter(field_name='author__id', lookup_expr='exact')
 
     class Meta:
         model = Recipe
         fields = ['tags', 'author']
+
+    def filter_tags(self, queryset, name, value):
+        tag_ids_by_slug = get_tag_ids_by_slug()
+        tag_ids = {tag_ids_by_slug[slug] for slug in value}
+        recipe_tags = Recipe.tags.through.objects.filter(tag_id__in=tag_ids)
+        if self.form.cleaned_data.get('tags_match') == TAGS_MATCH_ALL:
+            recipe_tags = recipe_tags.values('recipe_id').annotate(
+                tags_count=Count('tag_id')).filter(tags_count=len(tag_ids))
+        return queryset.filter(pk__in=recipe_tags.values('recipe_id'))
+
+    def filter_tags_match(self, queryset, name, value):
+        """Режим сопоставления учитывается в filter_tags"""
+
+        return queryset
@@ -0,0 +1,328 @@
+import base64
+import binascii
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+from api.cache import (CACHE_PREFIX, RECIPES_GENERATION, bump_generations,
+                       recipe_generation)
+from api.middleware import server_timing
+from recipes.models import Recipe
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# Варианты изображения рецепта для карточек: размер и форматы файлов
+IMAGE_VARIANTS = {
+    'thumb': (160, 160),
+    'card': (480, 360),
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков процесса для декодирования и пересжатия изображений"""
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.RECIPE_IMAGE_WORKERS,
+                    thread_name_prefix='recipe-image'
+                )
+    return _executor
+
+
+def base64_decoded_size(data):
+    """Размер данных после декодирования, без самого декодирования"""
+
+    data = data.rstrip()
+    padding = len(data) - len(data.rstrip('='))
+    return len(data) * 3 // 4 - padding
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def reencode_image(content):
+    """
+    Пересжатие изображения: поворот по EXIF, уменьшение до
+    RECIPE_IMAGE_MAX_SIDE по большей стороне и сохранение без
+    метаданных - в PNG при наличии прозрачности, иначе в JPEG
+    """
+
+    max_side = settings.RECIPE_IMAGE_MAX_SIDE
+    with Image.open(io.BytesIO(content)) as image:
+        # JPEG сразу декодируется в уменьшенном масштабе
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        icc_profile = image.info.get('icc_profile')
+        buffer = io.BytesIO()
+        if has_alpha(image):
+            extension = 'png'
+            image.convert('RGBA').save(
+                buffer, 'PNG', optimize=True, icc_profile=icc_profile)
+        else:
+            extension = 'jpg'
+            image.convert('RGB').save(
+                buffer,
+                'JPEG',
+                quality=settings.RECIPE_IMAGE_QUALITY,
+                optimize=True,
+                progressive=True,
+                icc_profile=icc_profile
+            )
+    return ContentFile(buffer.getvalue(), name=f'{uuid.uuid4()}.{extension}')
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Кастомный тип поля для изображения рецепта: размер и число пикселей
+    проверяются до полного декодирования, само пересжатие выполняется
+    в пуле потоков с ограниченным числом одновременных задач
+    """
+
+    default_error_messages = {
+        'invalid_image': 'Загрузите корректное изображение.',
+        'too_large': 'Размер изображения больше {max_size} МБ.',
+        'too_many_pixels': 'Изображение больше {max_pixels} Мпикс.',
+        'timeout': 'Не удалось обработать изображение, повторите позже.',
+    }
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            self.fail('invalid_image')
+        if ';base64,' in data:
+            data = data.split(';base64,', 1)[1]
+        if base64_decoded_size(data) > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large',
+                      max_size=settings.RECIPE_IMAGE_MAX_SIZE // 2 ** 20)
+        try:
+            content = base64.b64decode(data)
+        except (TypeError, binascii.Error, ValueError):
+            self.fail('invalid_image')
+        with server_timing('image'):
+            self.check_header(content)
+            future = get_executor().submit(reencode_image, content)
+            try:
+                return future.result(timeout=settings.RECIPE_IMAGE_TIMEOUT)
+            except TimeoutError:
+                future.cancel()
+                self.fail('timeout')
+            except (Image.DecompressionBombError, OSError, SyntaxError,
+                    ValueError):
+                self.fail('invalid_image')
+
+    def check_header(self, content):
+        """Формат и размеры читаются из заголовка файла"""
+
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                image_format, (width, height) = image.format, image.size
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS // 10 ** 6)
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            self.fail('invalid_image')
+        if image_format not in ALLOWED_FORMATS:
+            self.fail('invalid_image')
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS // 10 ** 6)
+
+
+def variant_name(name, variant, extension):
+    """
+    Имя файла варианта выводится из имени оригинала, поэтому
+    его не нужно хранить в базе: image/recipes/<имя>.thumb.webp
+    """
+
+    return f'{os.path.splitext(name)[0]}.{variant}.{extension}'
+
+
+def variants_ready_key(name):
+    return f'{CACHE_PREFIX}:image-variants:{name}'
+
+
+def variant_urls(name, storage=default_storage):
+    """
+    URL вариантов изображения; пока варианты не созданы (или их создание
+    не удалось), вместо них отдается URL оригинала. Готовность читается
+    из кэша, а не проверкой файлов в хранилище
+    """
+
+    ready = cache.get(variants_ready_key(name))
+    return {
+        variant: {
+            extension: storage.url(
+                variant_name(name, variant, extension) if ready else name)
+            for extension in VARIANT_FORMATS
+        }
+        for variant in IMAGE_VARIANTS
+    }
+
+
+def create_image_variants(name, storage=default_storage, overwrite=False):
+    """
+    Создание недостающих вариантов изображения, возвращает их число.
+    Когда все варианты есть в хранилище, это отмечается в кэше без срока
+    хранения: такие ключи не вытесняются при нехватке памяти Redis
+    """
+
+    missing = [
+        (variant, extension)
+        for variant in IMAGE_VARIANTS
+        for extension in VARIANT_FORMATS
+        if overwrite or not storage.exists(
+            variant_name(name, variant, extension))
+    ]
+    if not missing:
+        cache.set(variants_ready_key(name), True, None)
+        return 0
+    with storage.open(name, 'rb') as file:
+        with Image.open(file) as image:
+            image = ImageOps.exif_transpose(image)
+            if has_alpha(image):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+    for variant, extension in missing:
+        image_format, options = VARIANT_FORMATS[extension]
+        buffer = io.BytesIO()
+        ImageOps.fit(image, IMAGE_VARIANTS[variant]).save(
+            buffer, image_format, **options)
+        path = variant_name(name, variant, extension)
+        if storage.exists(path):
+            storage.delete(path)
+        save = getattr(storage, 'save_as', storage.save)
+        save(path, ContentFile(buffer.getvalue()))
+    cache.set(variants_ready_key(name), True, None)
+    return len(missing)
+
+
+def delete_unused_images(grace, storage=default_storage):
+    """
+    Удаление изображений, на которые не ссылается ни один рецепт, вместе
+    с вариантами; возвращает число удаленных файлов. Одинаковые
+    изображения хранятся один раз, и повторная загрузка уже
+    существующего файла обновляет его время изменения: файлы моложе
+    grace не удаляются, пока ссылающийся на них рецепт не сохранен
+    """
+
+    directory = Recipe._meta.get_field('image').upload_to
+    if not storage.exists(directory):
+        return 0
+    used = {
+        os.path.splitext(name)[0]
+        for name in Recipe.objects.exclude(image='').values_list(
+            'image', flat=True).distinct().iterator()
+    }
+    deadline = timezone.now() - grace
+    deleted = 0
+    for subdirectory in storage.listdir(directory)[0]:
+        path = os.path.join(directory, subdirectory)
+        groups = {}
+        for filename in storage.listdir(path)[1]:
+            stem = os.path.join(path, filename.split('.', 1)[0])
+            groups.setdefault(stem, []).append(os.path.join(path, filename))
+        for stem, paths in groups.items():
+            if stem in used or any(
+                    storage.get_modified_time(name) > deadline
+                    for name in paths):
+                continue
+            for name in paths:
+                storage.delete(name)
+            cache.delete_many([variants_ready_key(name) for name in paths])
+            deleted += len(paths)
+    return deleted
+
+
+def create_image_variants_task(name):
+    """
+    После создания вариантов сбрасываются поколения рецептов с этим
+    изображением: закэшированные ответы ссылаются на оригинал
+    """
+
+    try:
+        if create_image_variants(name):
+            recipe_ids = Recipe.objects.filter(
+                image=name).values_list('pk', flat=True)
+            bump_generations(
+                RECIPES_GENERATION, *map(recipe_generation, recipe_ids))
+    except Exception:
+        logger.exception('Image variants for %s failed', name)
+    finally:
+        connection.close()
+
+
+def schedule_image_variants(name):
+    """Варианты создаются в пуле потоков, вне обработки запроса"""
+
+    if name:
+        get_executor().submit(create_image_variants_task, name)
+
+
+class ImageVariantsField(serializers.Field):
+    """URL вариантов изображения рецепта по размерам и форматам"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        urls = variant_urls(value.name)
+        request = self.context.get('request')
+        if request is not None:
+            for formats in urls.values():
+                for extension, url in formats.items():
+                    formats[extension] = request.build_absolute_uri(url)
+        return urls
+
+
+class ImageVariantMixin:
+    """
+    Параметры запроса image_variant (thumb, card) и image_format
+    (jpg, webp) заменяют в ответе оригинал изображения вариантом
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        if request is None or not data.get('image_variants'):
+            return data
+        variant = request.query_params.get('image_variant')
+        extension = request.query_params.get('image_format', 'jpg')
+        if variant in IMAGE_VARIANTS and extension in VARIANT_FORMATS:
+            data['image'] = data['image_variants'][variant][extension]
+        return data
@@ -0,0 +1,138 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+
+from api.cache import CACHE_PREFIX
+from api.querysets import shopping_cart_totals
+from api.shopping_lists import cache_shopping_list
+from api.utils.utils import SHOPPING_LIST_TITLE, pdf_file_create
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+
+class QueueFull(Exception):
+    """Все места в очереди заданий текущего процесса заняты"""
+
+
+def get_jobs_cache():
+    """Кэш состояния заданий и готовых файлов, общий для всех процессов"""
+
+    return caches[settings.SHOPPING_CART_JOB_CACHE]
+
+
+def jobs_available():
+    """
+    Фоновые задания возможны только с общим кэшем: с кэшем в памяти
+    процесса опрос, попавший в другой воркер, не найдет задание
+    """
+
+    return not isinstance(get_jobs_cache(), LocMemCache)
+
+
+def job_key(job_id):
+    return f'{CACHE_PREFIX}:pdf-job:{job_id}'
+
+
+def job_result_key(job_id):
+    return f'{CACHE_PREFIX}:pdf-job:{job_id}:result'
+
+
+def user_job_key(user_id):
+    return f'{CACHE_PREFIX}:pdf-job:user:{user_id}'
+
+
+def get_executor():
+    """
+    Пул потоков процесса; семафор ограничивает число заданий,
+    которые одновременно выполняются или ждут в очереди
+    """
+
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(
+                    settings.SHOPPING_CART_JOB_WORKERS
+                    + settings.SHOPPING_CART_JOB_QUEUE
+                )
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.SHOPPING_CART_JOB_WORKERS,
+                    thread_name_prefix='shopping-cart-pdf'
+                )
+    return _executor
+
+
+def get_job(job_id):
+    return get_jobs_cache().get(job_key(job_id))
+
+
+def get_job_result(job_id):
+    return get_jobs_cache().get(job_result_key(job_id))
+
+
+def save_job(job):
+    get_jobs_cache().set(
+        job_key(job['id']), job, settings.SHOPPING_CART_JOB_TTL)
+
+
+def submit_shopping_cart_job(user, cache_key):
+    """
+    Ставит в очередь создание PDF со списком покупок пользователя,
+    готовый файл сохраняется и в кэш списков по ключу cache_key.
+    Пока предыдущее задание пользователя не завершено, возвращается оно
+    """
+
+    cache = get_jobs_cache()
+    job = {'id': uuid.uuid4().hex, 'user_id': user.id, 'status': PENDING,
+           'cache_key': cache_key}
+    for _ in range(2):
+        if cache.add(user_job_key(user.id), job['id'],
+                     settings.SHOPPING_CART_JOB_TTL):
+            break
+        active_job = get_job(cache.get(user_job_key(user.id)))
+        if active_job and active_job['status'] in ACTIVE_STATUSES:
+            return active_job
+        cache.delete(user_job_key(user.id))
+
+    executor = get_executor()
+    if not _slots.acquire(blocking=False):
+        cache.delete(user_job_key(user.id))
+        raise QueueFull
+    save_job(job)
+    executor.submit(run_shopping_cart_job, job)
+    return job
+
+
+def run_shopping_cart_job(job):
+    cache = get_jobs_cache()
+    try:
+        save_job({**job, 'status': RUNNING})
+        buffer = pdf_file_create(
+            shopping_cart_totals(job['user_id']), SHOPPING_LIST_TITLE)
+        cache.set(job_result_key(job['id']), buffer.getvalue(),
+                  settings.SHOPPING_CART_JOB_TTL)
+        cache_shopping_list(job['cache_key'], buffer.getvalue())
+        save_job({**job, 'status': DONE})
+    except Exception:
+        logger.exception('Shopping cart PDF job %s failed', job['id'])
+        save_job({**job, 'status': FAILED})
+    finally:
+        cache.delete(user_job_key(job['user_id']))
+        connection.close()
+        _slots.release()
@@ -0,0 +1,138 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_timings = ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def server_timing(name):
+    """
+    Время выполнения блока добавляется в Server-Timing, если текущий
+    запрос попал в выборку; иначе блок выполняется без замера
+    """
+
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = (
+            timings.get(name, 0) + time.perf_counter() - started)
+
+
+def view_name(request):
+    """Имя обработчика запроса, например RecipeViewSet.list"""
+
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = getattr(match.func, 'cls', None) or getattr(
+        match.func, 'view_class', None)
+    if view is None:
+        return f'{match.func.__module__}.{match.func.__name__}'
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return f'{view.__name__}.{actions.get(method, method)}'
+
+
+class QueryStats:
+    """Обертка execute_wrapper: число, время и повторы SQL-запросов"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def most_repeated(self):
+        """Чаще всего выполнявшийся текст SQL: признак N+1"""
+
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+class RequestTimingMiddleware:
+    """
+    Замер доли запросов REQUEST_TIMING_SAMPLE_RATE: число и время
+    SQL-запросов и отмеченные server_timing блоки отдаются в заголовке
+    Server-Timing. Медленные запросы и повторы одного SQL пишутся в лог.
+    Время потоковых ответов учитывается без отдачи содержимого
+    """
+
+    def __init__(self, get_response):
+        if settings.REQUEST_TIMING_SAMPLE_RATE <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        stats = QueryStats()
+        timings = {}
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = ', '.join(
+            [f'db;dur={stats.duration * 1000:.1f};'
+             f'desc="{stats.count} queries"']
+            + [f'{name};dur={value * 1000:.1f}'
+               for name, value in timings.items()]
+            + [f'total;dur={duration * 1000:.1f}']
+        )
+        self.log(request, response, stats, timings, duration)
+        return response
+
+    def log(self, request, response, stats, timings, duration):
+        sql, repeats = stats.most_repeated()
+        slow = duration * 1000 >= settings.REQUEST_TIMING_SLOW_MS
+        repeated = repeats >= settings.REQUEST_TIMING_REPEATED_QUERIES
+        if not slow and not repeated:
+            return
+        entry = {
+            'event': 'slow_request' if slow else 'repeated_queries',
+            'view': view_name(request),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'db_ms': round(stats.duration * 1000, 1),
+            'queries': stats.count,
+            'timings_ms': {
+                name: round(value * 1000, 1)
+                for name, value in timings.items()
+            },
+        }
+        if repeated:
+            entry['repeated_sql'] = sql[:500]
+            entry['repeated_count'] = repeats
+        logger.warning(json.dumps(entry, ensure_ascii=False))
@@ -0,0 +1,146 @@
+from functools import partial
+from http import HTTPStatus
+
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.response import Response
+
+from api.cache import cached_response, make_etag
+from api.prepared import get_prepared_payload, prepared_response
+from api.serializers import RecipeIdsSerializer
+from api.user_recipes import add_user_recipes, remove_user_recipes
+from recipes.models import Recipe
+
+
+class AnonymousCacheMixin:
+    """Кэширование ответов list/retrieve для анонимных пользователей"""
+
+    def get_list_cache_key(self, request):
+        raise NotImplementedError
+
+    def get_detail_cache_key(self, request):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return super().list(request, *args, **kwargs)
+        return cached_response(
+            self.get_list_cache_key(request),
+            partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return super().retrieve(request, *args, **kwargs)
+        return cached_response(
+            self.get_detail_cache_key(request),
+            partial(super().retrieve, request, *args, **kwargs)
+        )
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list/retrieve: ETag считается
+    до выборки и сериализации, при совпадении отдается 304.
+    Last-Modified не отдается: счетчики в ответе меняются без
+    изменения даты рецепта, а поколения в ETag учитывают и их
+    """
+
+    def get_etag_parts(self, request):
+        """Версии данных, от которых зависит ответ"""
+
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, partial(super().retrieve, request, *args, **kwargs))
+
+    def conditional_response(self, request, get_response):
+        etag = make_etag(
+            self.action, request.get_full_path(),
+            *self.get_etag_parts(request)
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = get_response()
+            if response.status_code != HTTPStatus.OK:
+                return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization', 'Accept-Encoding'))
+        return response
+
+
+class PreparedReferenceMixin:
+    """list/retrieve справочника из заранее подготовленного JSON"""
+
+    prepared_payload_name = None
+
+    def get_prepared_ids(self, request):
+        """id записей для отфильтрованного списка, None - список целиком"""
+
+        return None
+
+    def list(self, request, *args, **kwargs):
+        payload = get_prepared_payload(self.prepared_payload_name)
+        ids = self.get_prepared_ids(request)
+        if ids is None:
+            return prepared_response(request, payload.body, payload.gzipped)
+        return prepared_response(request, payload.slice(ids))
+
+    def retrieve(self, request, *args, **kwargs):
+        payload = get_prepared_payload(self.prepared_payload_name)
+        try:
+            body = payload.fragments[int(self.kwargs['pk'])]
+        except (KeyError, ValueError):
+            raise Http404
+        return prepared_response(request, body)
+
+
+class UserRecipesMixin:
+    """
+    Добавление рецептов в избранное или корзину и их удаление
+    по одному и списком; повторные добавление и удаление не ошибка
+    """
+
+    model = None
+
+    def add_recipe(self, request):
+        pk = int(self.kwargs['recipe_id'])
+        get_object_or_404(Recipe, pk=pk)
+        added = add_user_recipes(self.model, request.user, [pk])
+        instance = self.model.objects.select_related('recipe').get(
+            user=request.user, recipe_id=pk)
+        serializer = self.get_serializer(instance)
+        return Response(
+            serializer.data, HTTPStatus.CREATED if added else HTTPStatus.OK)
+
+    def remove_recipe(self, request):
+        pk = int(self.kwargs['recipe_id'])
+        remove_user_recipes(self.model, request.user, [pk])
+        return Response(status=HTTPStatus.NO_CONTENT)
+
+    def add_recipes(self, request, *args, **kwargs):
+        """Пакетное добавление: {"recipes": [id, ...]}"""
+
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added = add_user_recipes(
+            self.model, request.user, serializer.validated_data['recipes'])
+        return Response(
+            {'added': added},
+            HTTPStatus.CREATED if added else HTTPStatus.OK
+        )
+
+    def remove_recipes(self, request, *args, **kwargs):
+        """Пакетное удаление: {"recipes": [id, ...]}"""
+
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        removed = remove_user_recipes(
+            self.model, request.user, serializer.validated_data['recipes'])
+        return Response({'removed': removed})
@@ -1,7 +1,142 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPaginationClass(PageNumberPagination):
     """Кастомная пагинация для рецептов и пользователей"""
 
     page_size_query_param = 'recipes_limit'
+
+
+class CursorPaginationClass(CustomPaginationClass):
+    """
+    Keyset-пагинация по паре (pub_date, id): страница выбирается условием
+    WHERE по последней записи предыдущей страницы, без COUNT(*) и OFFSET.
+    Включается параметром cursor (пустой курсор - первая страница),
+    без него работает прежняя постраничная пагинация по page
+    """
+
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        if position is not None:
+            try:
+                queryset = queryset.filter(
+                    self.get_position_filter(position, reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page_results = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.page_results:
+            return None
+        return self.encode_cursor(self.page_results[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page_results:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page_results[0], reverse=True)
+
+    def get_ordering(self, reverse):
+        """Порядок сортировки, для обратного прохода - инвертированный"""
+
+        if not reverse:
+            return self.ordering
+        return [
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        ]
+
+    def get_position_filter(self, position, reverse):
+        """
+        Лексикографическое условие "строго после позиции" для полей
+        сортировки: (a < x) OR (a = x AND b < y) для убывающего порядка
+        """
+
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, obj, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            position.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        cursor = base64.urlsafe_b64encode(
+            json.dumps([position, reverse]).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            position, reverse = json.loads(base64.urlsafe_b64decode(
+                cursor.encode()).decode())
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+
+class SubscribePaginationClass(CursorPaginationClass):
+    """Keyset-пагинация для подписок по паре (date_joined, id)"""
+
+    ordering = ('-date_joined', '-id')
@@ -0,0 +1,77 @@
+import gzip
+import re
+import threading
+from collections import OrderedDict
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from api.cache import INGREDIENTS_GENERATION, TAGS_GENERATION, get_generations
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+PREPARED_SOURCES = {
+    TAGS_GENERATION: (Tag, TagSerializer),
+    INGREDIENTS_GENERATION: (Ingredient, IngredientSerializer),
+}
+
+
+class PreparedPayload:
+    """
+    Готовый JSON справочника: тело ответа целиком, его gzip-версия
+    и JSON каждой записи для сборки ответа по части записей
+    """
+
+    def __init__(self, data, generation=None):
+        renderer = JSONRenderer()
+        self.generation = generation
+        self.fragments = OrderedDict(
+            (item['id'], renderer.render(item)) for item in data)
+        self.body = b'[' + b','.join(self.fragments.values()) + b']'
+        self.gzipped = gzip.compress(self.body)
+
+    def slice(self, ids):
+        """JSON-список из записей с переданными id в их порядке"""
+
+        return b'[' + b','.join(
+            self.fragments[pk] for pk in ids if pk in self.fragments) + b']'
+
+
+_payloads = {}
+_payloads_lock = threading.Lock()
+
+
+def get_prepared_payload(name):
+    """
+    Подготовленный ответ текущего процесса; пересобирается, когда
+    сигналы об изменении справочника увеличили его поколение в кэше
+    """
+
+    generation, = get_generations(name)
+    payload = _payloads.get(name)
+    if payload is None or payload.generation != generation:
+        with _payloads_lock:
+            payload = _payloads.get(name)
+            if payload is None or payload.generation != generation:
+                model, serializer_class = PREPARED_SOURCES[name]
+                data = serializer_class(model.objects.all(), many=True).data
+                payload = _payloads[name] = PreparedPayload(data, generation)
+    return payload
+
+
+def prepared_response(request, body, gzipped=None):
+    """Ответ из готовых байтов, сжатый вариант - если клиент его принимает"""
+
+    response = HttpResponse(content_type='application/json')
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if gzipped is not None and ACCEPTS_GZIP.search(accept_encoding):
+        response.content = gzipped
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response.content = body
+    if gzipped is not None:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Length'] = len(response.content)
+    return response
@@ -0,0 +1,101 @@
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Sum, Value, Window, prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from recipes.models import (Favorite, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartTotal)
+from users.models import CustomUser, Subscribe
+
+
+def recipe_feed_queryset(user):
+    """
+    Рецепты со связанными автором, тегами и ингредиентами и,
+    для авторизованного пользователя, признаками избранного,
+    корзины и подписки на автора
+    """
+
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipeingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        )
+    )
+    if user.is_anonymous:
+        return queryset
+    return queryset.annotate(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe_id=OuterRef('pk')
+        )),
+        is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+            user=user, recipe_id=OuterRef('pk')
+        )),
+        is_subscribed=Exists(Subscribe.objects.filter(
+            user=user, author_id=OuterRef('author_id')
+        ))
+    )
+
+
+def shopping_cart_totals(user):
+    """
+    Суммарное количество каждого ингредиента из корзины пользователя
+    по поддерживаемой таблице итогов; одноименные ингредиенты
+    с одной единицей измерения объединяются
+    """
+
+    return ShoppingCartTotal.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit').order_by(
+            'ingredient__name').annotate(
+                ingredient_total=Sum('total'))
+
+
+class InSubquery(RawSQL):
+    """Подзапрос для поиска __in: скобки вокруг него добавляет сам поиск"""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def limited_recipes_queryset(authors, limit):
+    """
+    Не более limit последних рецептов каждого из авторов одним запросом:
+    номер рецепта у автора считает оконная функция ROW_NUMBER()
+    """
+
+    ranked = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()]
+        )
+    ).order_by().values('id', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.filter(pk__in=InSubquery(
+        f'SELECT "id" FROM ({sql}) AS "ranked" WHERE "row_number" <= %s',
+        (*params, limit)
+    ))
+
+
+def subscriptions_queryset(user):
+    """Авторы, на которых подписан пользователь, с признаком подписки"""
+
+    return CustomUser.objects.filter(following__user=user).annotate(
+        is_subscribed=Value(True, output_field=BooleanField()))
+
+
+def prefetch_short_recipes(authors, recipes_limit=None):
+    """
+    Последние рецепты (не более recipes_limit на автора) для уже
+    выбранной страницы авторов: ранжируются рецепты только этих авторов
+    """
+
+    recipes = Recipe.objects.all()
+    if recipes_limit:
+        recipes = limited_recipes_queryset(
+            [author.pk for author in authors], recipes_limit)
+    prefetch_related_objects(authors, Prefetch(
+        'recipes',
+        queryset=recipes.order_by('-pub_date', '-id'),
+        to_attr='short_recipes'
+    ))
@@ -0,0 +1,125 @@
+import bisect
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from api.cache import INGREDIENTS_GENERATION, get_generations
+from recipes.models import Ingredient
+
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+FUZZY_THRESHOLD = 0.3
+
+
+def normalize(value):
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+
+def trigrams(value):
+    """Триграммы слов строки с дополнением пробелами, как в pg_trgm"""
+
+    result = set()
+    for word in value.split():
+        padded = f'  {word} '
+        result.update(
+            padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IngredientSearchIndex:
+    """
+    Поисковый индекс ингредиентов в памяти процесса: сначала точное
+    совпадение, затем начало названия, начало слова, вхождение подстроки
+    и, в последнюю очередь, нечеткие совпадения по триграммам
+    """
+
+    def __init__(self, ingredients, generation=None):
+        self.generation = generation
+        self.items = sorted(
+            ingredients, key=lambda item: normalize(item['name']))
+        self.names = [normalize(item['name']) for item in self.items]
+        self.name_trigrams = [trigrams(name) for name in self.names]
+        self.postings = defaultdict(set)
+        for position, grams in enumerate(self.name_trigrams):
+            for gram in grams:
+                self.postings[gram].add(position)
+
+    @classmethod
+    def build(cls, generation=None):
+        return cls(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            generation
+        )
+
+    def search(self, query, limit=None):
+        """Ранжированный список не более чем из limit ингредиентов"""
+
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        if not query:
+            return self.items[:limit]
+
+        ranked = {}
+        start = bisect.bisect_left(self.names, query)
+        for position in range(start, len(self.names)):
+            if not self.names[position].startswith(query):
+                break
+            ranked[position] = (
+                EXACT if self.names[position] == query else PREFIX, 0)
+
+        query_grams = trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            for position in self.postings.get(gram, ()):
+                shared[position] += 1
+        if len(query) < 3 or ' ' in query:
+            candidates = range(len(self.names))
+        else:
+            candidates = shared
+        for position in candidates:
+            if position in ranked or query not in self.names[position]:
+                continue
+            words = self.names[position].split()
+            if any(word.startswith(query) for word in words):
+                ranked[position] = (WORD_PREFIX, 0)
+            else:
+                ranked[position] = (SUBSTRING, 0)
+
+        for position, count in shared.items():
+            if position in ranked:
+                continue
+            similarity = count / (
+                len(query_grams) + len(self.name_trigrams[position]) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                ranked[position] = (FUZZY, -similarity)
+
+        order = sorted(
+            ranked,
+            key=lambda position: (
+                *ranked[position],
+                len(self.names[position]),
+                self.names[position]
+            )
+        )
+        return [self.items[position] for position in order[:limit]]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """
+    Индекс текущего процесса; перестраивается, когда сигналы
+    об изменении ингредиентов увеличили их поколение в кэше
+    """
+
+    global _index
+    generation, = get_generations(INGREDIENTS_GENERATION)
+    index = _index
+    if index is None or index.generation != generation:
+        with _index_lock:
+            if _index is None or _index.generation != generation:
+                _index = IngredientSearchIndex.build(generation)
+            index = _index
+    return index
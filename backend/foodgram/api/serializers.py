@@ -1,12 +1,17 @@
 import webcolors
 
+from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.serializers import (SerializerMethodField, CharField,
                                         CurrentUserDefault, SlugRelatedField,
-                                        PrimaryKeyRelatedField, IntegerField,
+                                        IntegerField,
                                         UniqueTogetherValidator)
 
+from api.cart_totals import amounts_delta, apply_cart_deltas, cart_user_ids
+from api.counters import change_ingredients_version
+from api.images import ImageVariantMixin, ImageVariantsField, RecipeImageField
+from api.signals import bulk_changes
 from recipes.models import (Ingredient, Favorite, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
 from users.serializers import CustomUserReadSerializer
@@ -26,9 +31,72 @@ def recipe_ing_bulk_create(recipe, ingredients):
     return RecipeIngredient.objects.bulk_create(ing_list)
 
 
-def short_check_fav_and_cart(request, obj, model):
-    """Метод для оптимизации проверки"""
+def recipe_ing_update(recipe, ingredients):
+    """
+    Обновление ингредиентов рецепта по разнице с сохраненными:
+    неизменные строки не трогаем, остальные - одним bulk_update,
+    одним bulk_create и одним удалением. Возвращает прежние количества
+    """
 
+    submitted = {
+        ingredient['ingredient']['id']: ingredient['amount']
+        for ingredient in ingredients
+    }
+    stored = {
+        recipe_ingredient.ingredient_id: recipe_ingredient
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+            recipe=recipe)
+    }
+    old_amounts = {
+        ingredient_id: recipe_ingredient.amount
+        for ingredient_id, recipe_ingredient in stored.items()
+    }
+    to_update, to_create = [], []
+    for ingredient_id, amount in submitted.items():
+        recipe_ingredient = stored.get(ingredient_id)
+        if recipe_ingredient is None:
+            to_create.append(RecipeIngredient(
+                ingredient_id=ingredient_id, recipe=recipe, amount=amount))
+        elif recipe_ingredient.amount != amount:
+            recipe_ingredient.amount = amount
+            to_update.append(recipe_ingredient)
+    removed = [
+        recipe_ingredient.pk
+        for ingredient_id, recipe_ingredient in stored.items()
+        if ingredient_id not in submitted
+    ]
+    if removed:
+        # Версия ингредиентов и поколения кэша меняются в update()
+        with bulk_changes():
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+    RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+    RecipeIngredient.objects.bulk_create(to_create)
+    return old_amounts
+
+
+def recipe_tags_update(recipe, tags):
+    """Обновление тегов рецепта по разнице с сохраненными"""
+
+    recipe_tags = Recipe.tags.through.objects.filter(recipe=recipe)
+    stored = set(recipe_tags.values_list('tag_id', flat=True))
+    submitted = {tag.id for tag in tags}
+    if stored - submitted:
+        recipe_tags.filter(tag_id__in=stored - submitted).delete()
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe=recipe, tag_id=tag_id)
+        for tag_id in submitted - stored
+    ])
+
+
+def short_check_fav_and_cart(request, obj, model, annotation):
+    """
+    Метод для оптимизации проверки: значение берется из аннотации
+    queryset, запрос к базе выполняется только при ее отсутствии
+    """
+
+    value = getattr(obj, annotation, None)
+    if value is not None:
+        return value
     return (request.user.is_authenticated and model.objects.filter(
             user=request.user, recipe__id=obj.id).exists())
 
@@ -47,6 +115,36 @@ class HexColor(serializers.Field):
         return data
 
 
+class TagsPrimaryKeyField(serializers.Field):
+    """
+    Кастомный тип поля для списка тегов: все переданные id
+    проверяются и загружаются одним запросом
+    """
+
+    default_error_messages = {
+        'not_a_list': 'Ожидался список id тегов.',
+        'incorrect_type': 'Id тега должен быть целым числом.',
+        'does_not_exist': 'Теги не существуют: {pk_values}.',
+    }
+
+    def to_representation(self, value):
+        return [tag.pk for tag in value.all()]
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list')
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type')
+        tags = Tag.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in tags]
+        if missing:
+            self.fail('does_not_exist',
+                      pk_values=', '.join(map(str, missing)))
+        return [tags[pk] for pk in ids]
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для тегов"""
 
@@ -89,8 +187,13 @@ class RecipeIngredientRecordSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
         fields = ('id', 'amount')
 
+    def to_representation(self, instance):
+        """id ингредиента берется из внешнего ключа, без его загрузки"""
+
+        return {'id': instance.ingredient_id, 'amount': instance.amount}
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+
+class RecipeReadSerializer(ImageVariantMixin, serializers.ModelSerializer):
     """Сериализатор на чтение для рецептов"""
 
     tags = TagSerializer(read_only=True, many=True)
@@ -100,24 +203,35 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         source='recipeingredients'
     )
     author = CustomUserReadSerializer(read_only=True)
+    image_variants = ImageVariantsField(source='image')
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
 
     class Meta:
         model = Recipe
-        exclude = ['pub_date']
+        exclude = ['pub_date', 'in_carts_count', 'ingredients_version']
+
+    def to_representation(self, instance):
+        """Передаем автору аннотацию подписки из queryset рецептов"""
+
+        is_subscribed = getattr(instance, 'is_subscribed', None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
         """Добавлен ли рецепт с Избранное"""
 
         request = self.context.get('request')
-        return short_check_fav_and_cart(request, obj, Favorite)
+        return short_check_fav_and_cart(
+            request, obj, Favorite, 'is_favorited')
 
     def get_is_in_shopping_cart(self, obj):
         """Добавлен ли рецепт в Список покупок"""
 
         request = self.context.get('request')
-        return short_check_fav_and_cart(request, obj, ShoppingCart)
+        return short_check_fav_and_cart(
+            request, obj, ShoppingCart, 'is_in_shopping_cart')
 
 
 class RecipeRecordSerializer(serializers.ModelSerializer):
@@ -128,19 +242,17 @@ class RecipeRecordSerializer(serializers.ModelSerializer):
         slug_field='username',
         default=CurrentUserDefault()
     )
-    tags = PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = TagsPrimaryKeyField()
     ingredients = RecipeIngredientRecordSerializer(
         many=True,
         source='recipeingredients'
     )
-    image = Base64ImageField(max_length=None, use_url=False)
+    image = RecipeImageField(max_length=None, use_url=False)
 
     class Meta:
         model = Recipe
-        exclude = ['pub_date']
+        exclude = ['pub_date', 'favorites_count', 'in_carts_count',
+                   'ingredients_version']
         validators = [
             UniqueTogetherValidator(
                 queryset=Recipe.objects.all(),
@@ -149,37 +261,55 @@ class RecipeRecordSerializer(serializers.ModelSerializer):
             )
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('recipeingredients')
         tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
-        recipe.tags.set(tags)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags
+        ])
         recipe_ing_bulk_create(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        if validated_data.get('tags'):
-            instance.tags.set(validated_data.get('tags', instance.tags))
-        instance.ingredients.clear()
-        recipe_ing_bulk_create(instance, validated_data['recipeingredients'])
-        validated_data.pop('recipeingredients')
-        super().update(instance, validated_data)
-        instance.save()
-        return instance
+        tags = validated_data.pop('tags', None)
+        if tags:
+            recipe_tags_update(instance, tags)
+        ingredients = validated_data.pop('recipeingredients', None)
+        if ingredients is not None:
+            old_amounts = recipe_ing_update(instance, ingredients)
+            deltas = amounts_delta(old_amounts, {
+                ingredient['ingredient']['id']: ingredient['amount']
+                for ingredient in ingredients
+            })
+            if any(deltas.values()):
+                change_ingredients_version(instance.id)
+                apply_cart_deltas(cart_user_ids(instance.id), deltas)
+        return super().update(instance, validated_data)
 
     def validate_ingredients(self, value):
-        """Валидация повторяющихся ингредиентов"""
-
-        ingredients = []
-        for recipeingredient in value:
-            ing_id = recipeingredient['ingredient']['id']
-            if ing_id in ingredients:
-                raise serializers.ValidationError('Повторяющийся ингредиент!')
-            ingredients.append(ing_id)
+        """
+        Валидация повторяющихся и несуществующих ингредиентов:
+        все id проверяются одним запросом
+        """
+
+        ids = [
+            recipeingredient['ingredient']['id'] for recipeingredient in value
+        ]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError('Повторяющийся ингредиент!')
+        existing = set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True))
+        missing = [ing_id for ing_id in ids if ing_id not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не существуют: {", ".join(map(str, missing))}.')
         return value
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ImageVariantMixin, serializers.ModelSerializer):
     """Сериализатор для Избранного"""
 
     id = IntegerField(read_only=True, source='recipe.id')
@@ -190,14 +320,15 @@ class FavoriteSerializer(serializers.ModelSerializer):
         read_only=True,
         source='recipe.image'
     )
+    image_variants = ImageVariantsField(source='recipe.image')
     cooking_time = IntegerField(read_only=True, source='recipe.cooking_time')
 
     class Meta:
         model = Favorite
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(ImageVariantMixin, serializers.ModelSerializer):
     """Сериализатор для Списка Покупок"""
 
     id = IntegerField(read_only=True, source='recipe.id')
@@ -208,8 +339,42 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         read_only=True,
         source='recipe.image'
     )
+    image_variants = ImageVariantsField(source='recipe.image')
     cooking_time = IntegerField(read_only=True, source='recipe.cooking_time')
 
     class Meta:
         model = ShoppingCart
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class ShoppingCartTotalSerializer(serializers.Serializer):
+    """Сериализатор для итогов Списка Покупок"""
+
+    name = CharField(read_only=True, source='ingredient__name')
+    measurement_unit = CharField(
+        read_only=True,
+        source='ingredient__measurement_unit'
+    )
+    amount = IntegerField(read_only=True, source='ingredient_total')
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления"""
+
+    recipes = serializers.ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+    def validate_recipes(self, value):
+        """Валидация несуществующих рецептов одним запросом"""
+
+        ids = list(dict.fromkeys(value))
+        existing = set(
+            Recipe.objects.filter(id__in=ids).values_list('id', flat=True))
+        missing = [pk for pk in ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Рецепты не существуют: {", ".join(map(str, missing))}.')
+        return ids
@@ -0,0 +1,49 @@
+import datetime as dt
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from api.cache import CACHE_PREFIX, INGREDIENTS_GENERATION, get_generations
+from recipes.models import ShoppingCart
+
+
+def get_shopping_list_cache():
+    return caches[settings.SHOPPING_LIST_CACHE]
+
+
+def shopping_list_fingerprint(user):
+    """
+    Отпечаток содержимого корзины: id рецептов с версиями их
+    ингредиентов, версия справочника ингредиентов и дата в заголовке.
+    Одинаковые корзины разных пользователей дают один отпечаток
+    """
+
+    recipes = sorted(ShoppingCart.objects.filter(user=user).values_list(
+        'recipe_id', 'recipe__ingredients_version'))
+    ingredients, = get_generations(INGREDIENTS_GENERATION)
+    parts = [dt.date.today().isoformat(), ingredients, *recipes]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def shopping_list_cache_key(user, export_format):
+    fingerprint = shopping_list_fingerprint(user)
+    return f'{CACHE_PREFIX}:shopping-list:{export_format}:{fingerprint}'
+
+
+def get_cached_shopping_list(key):
+    return get_shopping_list_cache().get(key)
+
+
+def cache_shopping_list(key, content):
+    get_shopping_list_cache().set(key, content)
+
+
+def caching_stream(chunks, key):
+    """Отдает части ответа потоком и кэширует ответ после последней"""
+
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache_shopping_list(key, ''.join(content).encode())
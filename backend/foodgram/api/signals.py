@@ -0,0 +1,164 @@
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.cache import (INGREDIENTS_GENERATION, RECIPES_GENERATION,
+                       REFERENCE_GENERATION, TAGS_GENERATION,
+                       bump_generations, recipe_generation, user_generation)
+from api.counters import (change_ingredients_version, change_recipe_counter,
+                          change_recipes_count)
+from api.images import schedule_image_variants
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Subscribe
+
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_changes():
+    """
+    Пакетная операция сама меняет счетчики и поколения кэша:
+    внутри блока обработчики post_delete строк ничего не делают
+    """
+
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        _bulk.active = False
+
+
+def in_bulk_changes():
+    return getattr(_bulk, 'active', False)
+
+
+def counter_generations(model, recipe_ids):
+    """
+    Поколения, сбрасываемые при изменении счетчика model: favorites_count
+    есть в рецепте, а лента с ним обновится с истечением кэша.
+    in_carts_count в ответы API не входит
+    """
+
+    if model is Favorite:
+        return [recipe_generation(recipe_id) for recipe_id in recipe_ids]
+    return []
+
+
+def invalidate_after_commit(*generations):
+    """Сброс поколений кэша после фиксации транзакции записи"""
+
+    transaction.on_commit(partial(bump_generations, *generations))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_after_commit(
+        RECIPES_GENERATION, recipe_generation(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, **kwargs):
+    """Недостающие варианты изображения создаются после фиксации"""
+
+    transaction.on_commit(
+        partial(schedule_image_variants, instance.image.name))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Изменение ингредиента рецепта по одному, например в админке"""
+
+    if in_bulk_changes():
+        return
+    change_ingredients_version(instance.recipe_id)
+    invalidate_after_commit(
+        RECIPES_GENERATION, recipe_generation(instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Recipe):
+        invalidate_after_commit(
+            RECIPES_GENERATION, recipe_generation(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    invalidate_after_commit(
+        RECIPES_GENERATION, REFERENCE_GENERATION, TAGS_GENERATION)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    invalidate_after_commit(
+        RECIPES_GENERATION, REFERENCE_GENERATION, INGREDIENTS_GENERATION)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def viewer_state_changed(sender, instance, **kwargs):
+    """Избранное, корзина и подписки меняют ответы только для их владельца"""
+
+    if not in_bulk_changes():
+        invalidate_after_commit(user_generation(instance.user_id))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_counter_added(sender, instance, created, **kwargs):
+    """Счетчики меняются в той же транзакции, что и сама запись"""
+
+    if created:
+        change_recipe_counter(sender, [instance.recipe_id], 1)
+        invalidate_after_commit(
+            *counter_generations(sender, [instance.recipe_id]))
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_counter_removed(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    change_recipe_counter(sender, [instance.recipe_id], -1)
+    invalidate_after_commit(
+        *counter_generations(sender, [instance.recipe_id]))
+
+
+@receiver(post_save, sender=Recipe)
+def author_recipe_added(sender, instance, created, **kwargs):
+    if created:
+        change_recipes_count(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def author_recipe_removed(sender, instance, **kwargs):
+    change_recipes_count(instance.author_id, -1)
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Ответы рецептов сбрасываются только при изменении показываемых
+    в них данных автора: регистрация, вход и смена пароля их не меняют
+    """
+
+    if update_fields is not None and not set(
+            update_fields) & set(instance.public_fields):
+        return
+    if not created and instance.public_fields_changed():
+        invalidate_after_commit(RECIPES_GENERATION, REFERENCE_GENERATION)
+    instance.remember_public_fields()
@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - хэш его содержимого:
+    одинаковые файлы хранятся один раз, а файл по однажды выданному
+    URL никогда не меняется. Каталог и расширение берутся из имени
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        hexdigest = digest.hexdigest()
+        return os.path.join(
+            directory, hexdigest[:2], f'{hexdigest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self.save_as(
+            self.hashed_name(name, content), content, max_length)
+
+    def save_as(self, name, content, max_length=None):
+        """
+        Запись под заданным именем, если файла еще нет: для производных
+        файлов, имя которых уже выведено из хэша оригинала. У уже
+        существующего файла обновляется время изменения, чтобы очистка
+        неиспользуемых изображений не удалила его до сохранения рецепта
+        """
+
+        if self.touch(name):
+            return name
+        saved_name = super().save(name, content, max_length)
+        if saved_name != name:
+            # Тот же файл одновременно записал другой процесс:
+            # содержимое одинаковое, копия под другим именем не нужна
+            self.delete(saved_name)
+        return name
+
+    def touch(self, name):
+        """Обновление времени изменения, False - если файла нет"""
+
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
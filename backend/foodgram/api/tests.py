@@ -0,0 +1,442 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api.images import (create_image_variants, delete_unused_images,
+                        variant_urls)
+from api.shopping_lists import shopping_list_fingerprint
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Subscribe
+
+# Кэши в памяти процесса: тестам не нужен запущенный Redis
+TEST_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'test-{alias}',
+    }
+    for alias in settings.CACHES
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeFeedQueriesTests(APITestCase):
+    """Число SQL-запросов ленты и рецепта не зависит от их количества"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестов', password='pass-1234')
+        authors = [
+            CustomUser.objects.create_user(
+                email=f'author{num}@example.com', username=f'author{num}',
+                first_name='Автор', last_name=str(num), password='pass-1234')
+            for num in range(3)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {num}', slug=f'tag-{num}', color=f'#00000{num}')
+            for num in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {num}', measurement_unit='г')
+            for num in range(4)
+        ]
+        for num in range(8):
+            recipe = Recipe.objects.create(
+                author=authors[num % len(authors)],
+                name=f'Рецепт {num}',
+                text='Описание',
+                image='image/recipes/test.jpg',
+                cooking_time=10
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=num + 1)
+                for ingredient in ingredients
+            ])
+        cls.recipe = recipe
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.client.force_authenticate(self.user)
+
+    def test_recipe_list_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_recipe_detail_queries(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+    def test_recipe_detail_conditional_get(self):
+        self.client.force_authenticate(None)
+        url = f'/api/recipes/{self.recipe.pk}/'
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch('api.signals.invalidate_after_commit')
+    def test_author_generations_follow_public_fields(self, invalidate):
+        CustomUser.objects.create_user(
+            email='newcomer@example.com', username='newcomer',
+            password='pass-1234')
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.set_password('pass-5678')
+        user.save()
+        user.last_name = 'Тестов'
+        user.save(update_fields=['last_name'])
+        invalidate.assert_not_called()
+        user.first_name = 'Автор'
+        user.save()
+        invalidate.assert_called_once()
+
+    @override_settings(ALLOWED_HOSTS=['first.example.com',
+                                      'second.example.com'])
+    def test_anonymous_list_cache_keeps_request_host(self):
+        self.client.force_authenticate(None)
+        for host in ('first.example.com', 'second.example.com'):
+            response = self.client.get('/api/recipes/', HTTP_HOST=host)
+            self.assertTrue(
+                response.data['next'].startswith(f'http://{host}/'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImageVariantsTests(APITestCase):
+    """Варианты изображения, которых еще нет в хранилище"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестов', password='pass-1234')
+        cls.recipe = Recipe.objects.create(
+            author=author,
+            name='Рецепт',
+            text='Описание',
+            image='image/recipes/missing.jpg',
+            cooking_time=10
+        )
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def test_missing_variant_falls_back_to_original(self):
+        response = self.client.get(
+            f'/api/recipes/{self.recipe.pk}/',
+            {'image_variant': 'thumb', 'image_format': 'webp'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response.data['image'].endswith('/image/recipes/missing.jpg'))
+        self.assertEqual(
+            response.data['image_variants']['card']['jpg'],
+            response.data['image'])
+
+    def test_variant_readiness_is_read_from_cache(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            buffer = io.BytesIO()
+            Image.new('RGB', (640, 480), 'green').save(buffer, 'JPEG')
+            name = default_storage.save(
+                'image/recipes/variants.jpg', ContentFile(buffer.getvalue()))
+            storage = mock.Mock(url=default_storage.url)
+            self.assertEqual(
+                variant_urls(name, storage)['thumb']['webp'],
+                default_storage.url(name))
+            self.assertEqual(create_image_variants(name), 4)
+            thumb = variant_urls(name, storage)['thumb']['webp']
+            storage.exists.assert_not_called()
+        self.assertTrue(thumb.endswith('.thumb.webp'), thumb)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SubscriptionsQueriesTests(APITestCase):
+    """Рецепты подписок ранжируются только для авторов страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестов', password='pass-1234')
+        for num in range(4):
+            author = CustomUser.objects.create_user(
+                email=f'author{num}@example.com', username=f'author{num}',
+                first_name='Автор', last_name=str(num), password='pass-1234')
+            Subscribe.objects.create(user=cls.user, author=author)
+            for recipe_num in range(3):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {recipe_num}',
+                    text='Описание',
+                    image='image/recipes/test.jpg',
+                    cooking_time=10
+                )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_subscriptions_recipes_limit(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/users/subscriptions/', {'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        authors = response.data['results']
+        self.assertEqual([len(author['recipes']) for author in authors],
+                         [2] * len(authors))
+        ranked = [query['sql'] for query in queries.captured_queries
+                  if 'ROW_NUMBER' in query['sql']]
+        self.assertEqual(len(ranked), 1)
+        page_ids = ', '.join(str(author['id']) for author in authors)
+        self.assertEqual(
+            ranked[0].count(f'"author_id" IN ({page_ids})'), 2)
+        self.assertNotIn('subscribe', ranked[0])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeWriteQueriesTests(APITestCase):
+    """Число SQL-запросов записи рецепта не зависит от числа строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестов', password='pass-1234')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {num}', slug=f'tag-{num}', color=f'#00000{num}')
+            for num in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {num}', measurement_unit='г')
+            for num in range(10)
+        ]
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), '#8775D2').save(buffer, 'PNG')
+        cls.image = ('data:image/png;base64,'
+                     + base64.b64encode(buffer.getvalue()).decode())
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self, name, ingredients, tags, amount=1):
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': [tag.pk for tag in tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient in ingredients
+            ],
+        }
+
+    def create_recipe(self, name, ingredients, tags):
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                '/api/recipes/', self.recipe_data(name, ingredients, tags),
+                format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['ingredients']), len(ingredients))
+        return response.data['id']
+
+    def test_recipe_create_queries(self):
+        self.create_recipe('Рецепт 1', self.ingredients[:1], self.tags[:1])
+        self.create_recipe('Рецепт 2', self.ingredients, self.tags)
+
+    def test_recipe_update_queries(self):
+        """
+        Изменение количеств, новые и удаленные ингредиенты и теги:
+        одна строка каждого вида или несколько
+        """
+
+        cases = (
+            (self.ingredients[:2], self.ingredients[1:3],
+             self.tags[:1], self.tags[1:2]),
+            (self.ingredients[:6], self.ingredients[3:],
+             self.tags[:1], self.tags[1:]),
+        )
+        for num, (old, new, old_tags, new_tags) in enumerate(cases):
+            recipe_id = self.create_recipe(f'Рецепт {num}', old, old_tags)
+            data = self.recipe_data(f'Рецепт {num}', new, new_tags, amount=2)
+            del data['image']
+            with self.assertNumQueries(24):
+                response = self.client.patch(
+                    f'/api/recipes/{recipe_id}/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['ingredients']), len(new))
+
+    def test_shopping_list_fingerprint_follows_ingredients(self):
+        recipe_id = self.create_recipe(
+            'Рецепт', self.ingredients[:2], self.tags[:1])
+        reader = CustomUser.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестов', password='pass-1234')
+        for user in (self.author, reader):
+            ShoppingCart.objects.create(user=user, recipe_id=recipe_id)
+        fingerprint = shopping_list_fingerprint(self.author)
+        self.assertEqual(shopping_list_fingerprint(reader), fingerprint)
+        Favorite.objects.create(user=reader, recipe_id=recipe_id)
+        self.assertEqual(shopping_list_fingerprint(reader), fingerprint)
+        data = self.recipe_data('Рецепт', self.ingredients[:2],
+                                self.tags[:1], amount=5)
+        del data['image']
+        self.client.patch(f'/api/recipes/{recipe_id}/', data, format='json')
+        self.assertNotEqual(shopping_list_fingerprint(reader), fingerprint)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UnusedImagesTests(TestCase):
+    """Очистка файлов, на которые не ссылается ни один рецепт"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестов', password='pass-1234')
+
+    def save_image(self, content, age=0):
+        name = default_storage.save(
+            'image/recipes/upload.jpg', ContentFile(content))
+        old = time.time() - age
+        os.utime(default_storage.path(name), (old, old))
+        return name
+
+    def test_same_content_reuses_name(self):
+        name = self.save_image(b'same')
+        self.assertEqual(self.save_image(b'same'), name)
+        self.assertEqual(
+            default_storage.save_as(name, ContentFile(b'same')), name)
+
+    def test_only_old_unreferenced_images_deleted(self):
+        used = self.save_image(b'used', age=7200)
+        Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            image=used, cooking_time=10)
+        unused = self.save_image(b'unused', age=7200)
+        recent = self.save_image(b'recent')
+        self.assertEqual(delete_unused_images(timedelta(hours=1)), 1)
+        self.assertTrue(default_storage.exists(used))
+        self.assertFalse(default_storage.exists(unused))
+        self.assertTrue(default_storage.exists(recent))
+
+    def test_reused_image_is_not_deleted(self):
+        name = self.save_image(b'shared', age=7200)
+        self.assertEqual(default_storage.save(
+            'image/recipes/upload.jpg', ContentFile(b'shared')), name)
+        self.assertEqual(delete_unused_images(timedelta(hours=1)), 0)
+        self.assertTrue(default_storage.exists(name))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdminChangelistQueriesTests(TestCase):
+    """Число SQL-запросов списков админки не зависит от числа строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', username='admin', first_name='Админ',
+            last_name='Тестов', password='pass-1234')
+        users = []
+        for num in range(5):
+            user = CustomUser.objects.create_user(
+                email=f'user{num}@example.com', username=f'user{num}',
+                first_name='Пользователь', last_name=str(num),
+                password='pass-1234')
+            recipe = Recipe.objects.create(
+                author=user,
+                name=f'Рецепт {num}',
+                text='Описание',
+                image='image/recipes/test.jpg',
+                cooking_time=10
+            )
+            ingredient = Ingredient.objects.create(
+                name=f'Ингредиент {num}', measurement_unit='г')
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=num + 1)
+            Favorite.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            users.append(user)
+        for num, user in enumerate(users):
+            Subscribe.objects.create(user=user, author=users[num - 1])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_changelist_queries(self, url, queries, result_count=5):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, result_count)
+
+    def test_user_changelist_queries(self):
+        self.assert_changelist_queries('/admin/users/customuser/', 4, 6)
+
+    def test_subscribe_changelist_queries(self):
+        self.assert_changelist_queries('/admin/users/subscribe/', 4)
+
+    def test_ingredient_changelist_queries(self):
+        self.assert_changelist_queries('/admin/recipes/ingredient/', 4)
+
+    def test_recipe_ingredient_changelist_queries(self):
+        self.assert_changelist_queries(
+            '/admin/recipes/recipeingredient/', 4)
+
+    def test_recipe_changelist_queries(self):
+        self.assert_changelist_queries('/admin/recipes/recipe/', 5)
+
+    def test_favorite_changelist_queries(self):
+        self.assert_changelist_queries('/admin/recipes/favorite/', 4)
+
+    def test_shopping_cart_changelist_queries(self):
+        self.assert_changelist_queries('/admin/recipes/shoppingcart/', 4)
+
+    def test_recipe_changelist_prefix_search(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/admin/recipes/recipe/', {'q': 'Рец'})
+        self.assertEqual(response.context['cl'].result_count, 5)
+        response = self.client.get('/admin/recipes/recipe/', {'q': 'ецепт'})
+        self.assertEqual(response.context['cl'].result_count, 0)
@@ -20,9 +20,22 @@ urlpatterns = [
          views.ShoppingCartViewSet.as_view({'post': 'cart_create',
                                             'delete': 'cart_delete'}),
          name='shopping_carts'),
+    path('recipes/favorite/',
+         views.FavoriteViewSet.as_view({'post': 'add_recipes',
+                                        'delete': 'remove_recipes'}),
+         name='favorites_batch'),
+    path('recipes/shopping_cart/',
+         views.ShoppingCartViewSet.as_view({'get': 'cart_totals',
+                                            'post': 'add_recipes',
+                                            'delete': 'remove_recipes'}),
+         name='shopping_cart_totals'),
     path('recipes/download_shopping_cart/',
          views.ShoppingCartDownloadViewSet.as_view({'get': 'download'}),
          name='download_shopping_cart'),
+    path('recipes/download_shopping_cart/<job_id>/',
+         views.ShoppingCartDownloadViewSet.as_view(
+             {'get': 'download_result'}),
+         name='download_shopping_cart_result'),
     path('users/subscriptions/',
          user_views.SubscribeViewSet.as_view({'get': 'list'}),
          name='subscriptions'),
@@ -0,0 +1,70 @@
+from django.db import transaction
+
+from api.cache import user_generation
+from api.cart_totals import (add_recipes_to_cart_totals,
+                             remove_recipes_from_cart_totals)
+from api.counters import change_recipe_counter
+from api.signals import (bulk_changes, counter_generations,
+                         invalidate_after_commit)
+from recipes.models import ShoppingCart
+from users.models import CustomUser
+
+
+def lock_user(user_id):
+    """
+    Блокировка строки пользователя: изменения его избранного
+    и корзины выполняются последовательно
+    """
+
+    list(CustomUser.objects.select_for_update().filter(
+        pk=user_id).values_list('pk', flat=True))
+
+
+@transaction.atomic
+def add_user_recipes(model, user, recipe_ids):
+    """
+    Добавление рецептов в избранное или корзину (model) одним INSERT;
+    уже добавленные рецепты пропускаются. Возвращает id добавленных
+    """
+
+    lock_user(user.id)
+    existing = set(model.objects.filter(
+        user=user, recipe_id__in=recipe_ids).values_list(
+            'recipe_id', flat=True))
+    added = [pk for pk in dict.fromkeys(recipe_ids) if pk not in existing]
+    if not added:
+        return added
+    model.objects.bulk_create(
+        [model(user=user, recipe_id=pk) for pk in added],
+        ignore_conflicts=True
+    )
+    if model is ShoppingCart:
+        add_recipes_to_cart_totals(user.id, added)
+    # bulk_create не отправляет post_save
+    change_recipe_counter(model, added, 1)
+    invalidate_after_commit(
+        user_generation(user.id), *counter_generations(model, added))
+    return added
+
+
+@transaction.atomic
+def remove_user_recipes(model, user, recipe_ids):
+    """
+    Удаление рецептов из избранного или корзины (model) одним DELETE;
+    отсутствующие рецепты пропускаются. Возвращает id удаленных
+    """
+
+    lock_user(user.id)
+    entries = model.objects.filter(user=user, recipe_id__in=recipe_ids)
+    removed = list(entries.values_list('recipe_id', flat=True))
+    if not removed:
+        return removed
+    # Счетчики и поколения кэша меняются ниже сразу для всех строк
+    with bulk_changes():
+        entries.delete()
+    if model is ShoppingCart:
+        remove_recipes_from_cart_totals(user.id, removed)
+    change_recipe_counter(model, removed, -1)
+    invalidate_after_commit(
+        user_generation(user.id), *counter_generations(model, removed))
+    return removed
@@ -1,43 +1,202 @@
+import csv
 import datetime as dt
 import io
+import json
+import os
+import threading
 
+from django.conf import settings
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase.pdfmetrics import registerFont
+from reportlab.pdfbase.pdfmetrics import registerFont, stringWidth
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
+SHOPPING_LIST_TITLE = 'Список покупок'
+CSV_HEADER = ('name', 'measurement_unit', 'amount')
+
+FONTS = {
+    'BuyanThin': 'BuyanThin.ttf',
+    'BuyanReg': 'BuyanRegular.ttf',
+}
+
+_fonts_registered = False
+_fonts_lock = threading.Lock()
+
+
+def format_item(num, obj):
+    """Строка списка покупок: номер, ингредиент, количество"""
+
+    return (f'{num}. {obj["ingredient__name"]} - '
+            f'{obj["ingredient_total"]} '
+            f'{obj["ingredient__measurement_unit"]}.')
+
+
+def register_fonts():
+    """
+    Шрифты разбираются и регистрируются один раз на процесс;
+    в документ reportlab встраивает только использованные глифы
+    """
+
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    with _fonts_lock:
+        if not _fonts_registered:
+            for name, filename in FONTS.items():
+                registerFont(TTFont(
+                    name, os.path.join(settings.BASE_DIR, 'data', filename)))
+            _fonts_registered = True
+
+
+class ShoppingListRenderer:
+    """
+    Переиспользуемый рендерер списка покупок в PDF: шапка страницы
+    рисуется один раз как шаблон (form XObject), строки списка
+    выводятся текстовыми блоками в несколько колонок
+    """
+
+    page_size = A4
+    margin = 40
+    header_height = 60
+    footer_height = 30
+    title_font = ('BuyanReg', 25)
+    item_font = ('BuyanThin', 14)
+    footer_font = ('BuyanThin', 10)
+    line_height = 20
+    column_gap = 20
+    template_name = 'shopping_list_page'
+
+    def __init__(self, columns=2):
+        register_fonts()
+        self.columns = columns
+        width, height = self.page_size
+        self.column_width = (
+            width - 2 * self.margin - (columns - 1) * self.column_gap
+        ) / columns
+        self.top = height - self.margin - self.header_height
+        self.bottom = self.margin + self.footer_height
+        self.lines_per_column = int(
+            (self.top - self.bottom) // self.line_height) + 1
+
+    def render(self, items, title):
+        """PDF-файл в памяти со списком items под заголовком title"""
+
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=self.page_size)
+        pdf.setTitle(title)
+        self.draw_template(pdf, f'{title} на {dt.date.today():%d-%m-%Y}')
+
+        lines = [self.format_line(num, obj)
+                 for num, obj in enumerate(items, start=1)]
+        per_page = self.lines_per_column * self.columns
+        page_number = 1
+        for start in range(0, len(lines) or 1, per_page):
+            if start:
+                pdf.showPage()
+                page_number += 1
+            self.draw_page(pdf, lines[start:start + per_page], page_number)
+        pdf.showPage()
+        pdf.save()
+        buffer.seek(0)
+        return buffer
+
+    def draw_template(self, pdf, heading):
+        width, height = self.page_size
+        pdf.beginForm(self.template_name)
+        pdf.setFont(*self.title_font)
+        pdf.drawString(self.margin, height - self.margin - 25, heading)
+        pdf.setLineWidth(0.5)
+        pdf.line(self.margin, self.top + self.line_height,
+                 width - self.margin, self.top + self.line_height)
+        pdf.endForm()
+
+    def draw_page(self, pdf, lines, page_number):
+        pdf.doForm(self.template_name)
+        for column in range(self.columns):
+            column_lines = lines[column * self.lines_per_column:
+                                 (column + 1) * self.lines_per_column]
+            if not column_lines:
+                break
+            text = pdf.beginText(
+                self.margin + column * (self.column_width + self.column_gap),
+                self.top
+            )
+            text.setFont(*self.item_font, leading=self.line_height)
+            for line in column_lines:
+                text.textLine(line)
+            pdf.drawText(text)
+        pdf.setFont(*self.footer_font)
+        pdf.drawRightString(
+            self.page_size[0] - self.margin, self.margin, str(page_number))
+
+    def format_line(self, num, obj):
+        return self.fit(format_item(num, obj))
+
+    def fit(self, line):
+        """Обрезаем строку многоточием по ширине колонки"""
+
+        font, size = self.item_font
+        if stringWidth(line, font, size) <= self.column_width:
+            return line
+        while line and stringWidth(
+                line + '…', font, size) > self.column_width:
+            line = line[:-1]
+        return line + '…'
+
+
+_renderer = None
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = ShoppingListRenderer()
+    return _renderer
+
 
 def pdf_file_create(list, text):
     """Кастомный метод для создания файла PDF"""
 
-    buffer = io.BytesIO()
-    NOW = dt.datetime.now()
-    START_A, START_B = 40, 720
-
-    cart = canvas.Canvas(buffer, pagesize=A4)
-    registerFont(TTFont('BuyanThin', './data/BuyanThin.ttf'))
-    registerFont(TTFont('BuyanReg', './data/BuyanRegular.ttf'))
-    cart.setFont('BuyanReg', 25)
-    cart.setTitle(f'{text}')
-    cart.drawString(START_A,
-                    START_B + 25,
-                    f'{text} на {NOW.strftime("%d-%m-%Y")}')
-    START_B -= 30
-    cart.setFont('BuyanThin', 17)
-    for num, obj in enumerate(list, start=1):
-        if START_B < 100:
-            START_B = 750
-            cart.showPage()
-            cart.setFont('BuyanThin', 17)
-        cart.drawString(
-            START_A,
-            START_B,
-            f'{num}. {obj["ingredient__name"]} - '
-            f'{obj["ingredient_total"]} '
-            f'{obj["ingredient__measurement_unit"]}.'
-        )
-        START_B -= 30
-    cart.showPage()
-    cart.save()
-    buffer.seek(0)
-    return buffer
+    return get_renderer().render(list, text)
+
+
+def shopping_list_txt(items, title=SHOPPING_LIST_TITLE):
+    """Построчная выгрузка списка покупок в текстовом виде"""
+
+    yield f'{title} на {dt.date.today():%d-%m-%Y}\n\n'
+    for num, obj in enumerate(items, start=1):
+        yield format_item(num, obj) + '\n'
+
+
+class EchoBuffer:
+    """Псевдобуфер: csv.writer возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_csv(items):
+    """Построчная выгрузка списка покупок в формате CSV"""
+
+    writer = csv.writer(EchoBuffer())
+    yield writer.writerow(CSV_HEADER)
+    for obj in items:
+        yield writer.writerow((
+            obj['ingredient__name'],
+            obj['ingredient__measurement_unit'],
+            obj['ingredient_total']
+        ))
+
+
+def shopping_list_json(items):
+    """Поэлементная выгрузка списка покупок JSON-массивом"""
+
+    separator = '['
+    for obj in items:
+        yield separator + json.dumps(dict(zip(CSV_HEADER, (
+            obj['ingredient__name'],
+            obj['ingredient__measurement_unit'],
+            obj['ingredient_total']
+        ))), ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
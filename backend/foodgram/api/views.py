@@ -1,57 +1,94 @@
+import io
 from http import HTTPStatus
 
-from django.http import FileResponse
-from django.db.models import Exists, OuterRef, Sum
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework import permissions, viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from api.utils.utils import pdf_file_create
-from recipes.models import (Ingredient, Favorite, Recipe,
-                            RecipeIngredient, ShoppingCart, Tag)
+from api import jobs
+from api.cart_totals import (apply_cart_deltas, cart_user_ids, negate,
+                             recipe_amounts)
+from api.cache import (INGREDIENTS_GENERATION, RECIPES_GENERATION,
+                       REFERENCE_GENERATION, TAGS_GENERATION, cache_period,
+                       get_generations, recipe_detail_cache_key,
+                       recipe_generation, recipe_list_cache_key,
+                       viewer_generation)
+from api.middleware import server_timing
+from api.mixins import (AnonymousCacheMixin, ConditionalGetMixin,
+                        PreparedReferenceMixin, UserRecipesMixin)
+from api.querysets import recipe_feed_queryset, shopping_cart_totals
+from api.search import get_ingredient_index
+from api.shopping_lists import (cache_shopping_list, caching_stream,
+                                get_cached_shopping_list,
+                                shopping_list_cache_key)
+from api.utils.utils import (SHOPPING_LIST_TITLE, pdf_file_create,
+                             shopping_list_csv, shopping_list_json,
+                             shopping_list_txt)
+from recipes.models import Ingredient, Favorite, ShoppingCart, Tag
 from users.permissions import AuthorOrReadOnly, ReadOnly
-from .filters import IngredientFilter, RecipeFilter
+from .filters import RecipeFilter
+from .negotiation import IgnoreFormatContentNegotiation
+from .pagination import CursorPaginationClass
 from .serializers import (IngredientSerializer, RecipeReadSerializer,
                           RecipeRecordSerializer, TagSerializer,
-                          FavoriteSerializer, ShoppingCartSerializer)
+                          FavoriteSerializer, ShoppingCartSerializer,
+                          ShoppingCartTotalSerializer)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalGetMixin, PreparedReferenceMixin,
+                 viewsets.ModelViewSet):
     """Вьюсет для обработки запросов к тегам"""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [ReadOnly]
     pagination_class = None
+    prepared_payload_name = TAGS_GENERATION
 
+    def get_etag_parts(self, request):
+        return get_generations(TAGS_GENERATION)
 
-class IngredientViewSet(viewsets.ModelViewSet):
+
+class IngredientViewSet(ConditionalGetMixin, PreparedReferenceMixin,
+                        viewsets.ModelViewSet):
     """Вьюсет для обработки запросов к ингредиентам"""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [ReadOnly]
     pagination_class = None
-    filterset_class = IngredientFilter
+    prepared_payload_name = INGREDIENTS_GENERATION
+
+    def get_etag_parts(self, request):
+        return get_generations(INGREDIENTS_GENERATION)
+
+    def get_prepared_ids(self, request):
+        """Поиск по названию выполняется по индексу в памяти"""
 
+        name = request.query_params.get('name')
+        if not name:
+            return None
+        return [
+            ingredient['id']
+            for ingredient in get_ingredient_index().search(name)
+        ]
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для обработки запросов к рецептам"""
 
     serializer_class = RecipeRecordSerializer
     filterset_class = RecipeFilter
+    pagination_class = CursorPaginationClass
 
     def get_queryset(self):
+        queryset = recipe_feed_queryset(self.request.user)
         if self.request.user.is_anonymous:
-            return Recipe.objects.all()
-        queryset = Recipe.objects.annotate(
-            is_favorited=Exists(Favorite.objects.filter(
-                user=self.request.user, recipe_id=OuterRef('pk')
-            )),
-            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
-                user=self.request.user, recipe_id=OuterRef('pk')
-            ))
-        )
+            return queryset
         if self.request.GET.get('is_favorited'):
             return queryset.filter(is_favorited=True)
         if self.request.GET.get('is_in_shopping_cart'):
@@ -75,82 +112,189 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        apply_cart_deltas(
+            cart_user_ids(instance.id), negate(recipe_amounts(instance.id)))
+        instance.delete()
+
+    def get_list_cache_key(self, request):
+        return recipe_list_cache_key(request)
+
+    def get_detail_cache_key(self, request):
+        return recipe_detail_cache_key(request, self.kwargs['pk'])
+
+    def get_etag_parts(self, request):
+        """
+        Версия рецептов (или справочников и конкретного рецепта)
+        и версия избранного, корзины и подписок пользователя. Счетчики
+        избранного не сбрасывают ленту: она обновляется раз в интервал
+        """
+
+        if self.action == 'list':
+            generations = [
+                *get_generations(RECIPES_GENERATION), cache_period()]
+        else:
+            generations = get_generations(
+                REFERENCE_GENERATION, recipe_generation(self.kwargs['pk']))
+        return [*generations, viewer_generation(request.user)]
+
 
-class FavoriteViewSet(viewsets.ModelViewSet):
+class FavoriteViewSet(UserRecipesMixin, viewsets.ModelViewSet):
     """Вьюсет для обработки запросов к списку избранных рецептов"""
 
     queryset = Favorite.objects.all()
     serializer_class = FavoriteSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = None
+    model = Favorite
 
     def favorite_create(self, request, *args, **kwargs):
         """Кастомный метод для добавления рецепта в избранное"""
 
-        pk = int(self.kwargs['recipe_id'])
-        favorite = Favorite.objects.create(user=request.user, recipe_id=pk)
-        serializer = FavoriteSerializer(favorite, context={'request': request})
-        return Response(serializer.data, HTTPStatus.CREATED)
+        return self.add_recipe(request)
 
     def favorite_delete(self, request, *args, **kwargs):
         """Кастомный метод для удаления рецепта из избранного"""
 
-        pk = int(self.kwargs['recipe_id'])
-        favorite = get_object_or_404(
-            Favorite,
-            user=request.user,
-            recipe_id=pk
-        )
-        favorite.delete()
-        return Response(HTTPStatus.NO_CONTENT)
+        return self.remove_recipe(request)
 
 
-class ShoppingCartViewSet(viewsets.ModelViewSet):
+class ShoppingCartViewSet(UserRecipesMixin, viewsets.ModelViewSet):
     """Вьюсет для обработки запросов к списку покупок"""
 
     queryset = ShoppingCart.objects.all()
     serializer_class = ShoppingCartSerializer
     permission_classes = [AuthorOrReadOnly]
     pagination_class = None
+    model = ShoppingCart
 
     def cart_create(self, request, *args, **kwargs):
         """Кастомный метод для добавления рецепта в список покупок"""
 
-        pk = int(self.kwargs['recipe_id'])
-        cart = ShoppingCart.objects.create(user=request.user, recipe_id=pk)
-        serializer = ShoppingCartSerializer(cart, context={'request': request})
-        return Response(serializer.data, HTTPStatus.CREATED)
+        return self.add_recipe(request)
 
     def cart_delete(self, request, *args, **kwargs):
         """Кастомный метод для удаления рецепта из списка покупок"""
 
-        pk = int(self.kwargs['recipe_id'])
-        cart = get_object_or_404(
-            ShoppingCart,
-            user=request.user,
-            recipe_id=pk
-        )
-        cart.delete()
-        return Response(HTTPStatus.NO_CONTENT)
+        return self.remove_recipe(request)
+
+    def cart_totals(self, request, *args, **kwargs):
+        """Текущие итоги списка покупок по ингредиентам"""
+
+        serializer = ShoppingCartTotalSerializer(
+            shopping_cart_totals(request.user), many=True)
+        return Response(serializer.data)
+
+    def get_permissions(self):
+        if self.action == 'cart_totals':
+            return [permissions.IsAuthenticated()]
+        return super().get_permissions()
 
 
 class ShoppingCartDownloadViewSet(viewsets.ModelViewSet):
     """Вьюсет для загрузки списка покупок"""
 
     permission_classes = [permissions.IsAuthenticated]
+    content_negotiation_class = IgnoreFormatContentNegotiation
+    content_types = {
+        'pdf': 'application/pdf',
+        'txt': 'text/plain; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+        'json': 'application/json',
+    }
+    streaming_formats = {
+        'txt': shopping_list_txt,
+        'csv': shopping_list_csv,
+        'json': shopping_list_json,
+    }
 
     def download(self, request):
-        """Кастомный метод для создания и скачивания списка покупок"""
-
-        shopping_cart = RecipeIngredient.objects.filter(
-            recipe__shopping_carts__user=request.user).values(
-                'ingredient__name', 'ingredient__measurement_unit').order_by(
-                    'ingredient__name').annotate(
-                        ingredient_total=Sum('amount'))
-        downloading_file = pdf_file_create(shopping_cart, 'Список покупок')
+        """
+        Кастомный метод для создания и скачивания списка покупок.
+        Формат задается параметром format: pdf (по умолчанию),
+        txt, csv или json; текстовые форматы отдаются потоком.
+        Повторная загрузка неизменной корзины отдается из кэша
+        """
+
+        export_format = request.query_params.get('format', 'pdf')
+        if export_format not in self.content_types:
+            raise ValidationError({'format': [
+                f'Доступные форматы: {", ".join(self.content_types)}.'
+            ]})
+        cache_key = shopping_list_cache_key(request.user, export_format)
+        content = get_cached_shopping_list(cache_key)
+        if content is not None:
+            return self.file_response(io.BytesIO(content), export_format)
+        # Без общего кэша заданий PDF создается сразу, в этом запросе
+        if (export_format == 'pdf' and request.query_params.get('async')
+                and jobs.jobs_available()):
+            return self.download_async(request, cache_key)
+
+        shopping_cart = shopping_cart_totals(request.user)
+        if export_format == 'pdf':
+            with server_timing('pdf'):
+                downloading_file = pdf_file_create(
+                    shopping_cart, SHOPPING_LIST_TITLE)
+            cache_shopping_list(cache_key, downloading_file.getvalue())
+            return self.file_response(downloading_file, export_format)
+        generator = self.streaming_formats[export_format]
+        response = StreamingHttpResponse(
+            caching_stream(generator(shopping_cart.iterator()), cache_key),
+            content_type=self.content_types[export_format]
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{export_format}"')
+        return response
+
+    def file_response(self, file, export_format):
         return FileResponse(
-            downloading_file,
+            file,
             as_attachment=True,
-            filename='shopping_cart.pdf',
+            filename=f'shopping_cart.{export_format}',
+            content_type=self.content_types[export_format],
             status=HTTPStatus.OK
         )
+
+    def download_async(self, request, cache_key):
+        """Постановка создания PDF в очередь фоновых заданий"""
+
+        try:
+            job = jobs.submit_shopping_cart_job(request.user, cache_key)
+        except jobs.QueueFull:
+            return Response(
+                {'detail': 'Очередь заданий заполнена, повторите позже.'},
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '5'}
+            )
+        return self.job_status_response(request, job)
+
+    def download_result(self, request, job_id):
+        """Статус фонового задания или готовый файл со списком покупок"""
+
+        job = jobs.get_job(job_id)
+        if job is None or job['user_id'] != request.user.id:
+            raise Http404
+        if job['status'] == jobs.DONE:
+            result = jobs.get_job_result(job_id)
+            if result is None:
+                raise Http404
+            return self.file_response(io.BytesIO(result), 'pdf')
+        if job['status'] == jobs.FAILED:
+            return Response(
+                {'id': job['id'], 'status': job['status'],
+                 'detail': 'Не удалось создать список покупок, '
+                           'повторите запрос.'},
+                HTTPStatus.UNPROCESSABLE_ENTITY
+            )
+        return self.job_status_response(request, job)
+
+    def job_status_response(self, request, job):
+        location = reverse(
+            'download_shopping_cart_result', args=(job['id'],))
+        return Response(
+            {'id': job['id'], 'status': job['status'],
+             'result': request.build_absolute_uri(location)},
+            HTTPStatus.ACCEPTED,
+            headers={'Location': location}
+        )
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,6 +103,85 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    # Счетчики поколений и ответы API: общий для всех воркеров кэш,
+    # иначе после изменения данных другие воркеры отдают устаревшее
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django_redis.cache.RedisCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default='redis://redis:6379/1'
+        ),
+    },
+    # Фоновые задания создания PDF: общий для всех воркеров кэш
+    'jobs': {
+        'BACKEND': os.getenv(
+            'JOBS_CACHE_BACKEND',
+            default='django_redis.cache.RedisCache'
+        ),
+        'LOCATION': os.getenv(
+            'JOBS_CACHE_LOCATION',
+            default='redis://redis:6379/2'
+        ),
+    },
+    # Готовые списки покупок по отпечатку корзины: общий Redis,
+    # объем памяти ограничивает его maxmemory (вытеснение LRU)
+    'shopping_lists': {
+        'BACKEND': os.getenv(
+            'SHOPPING_LIST_CACHE_BACKEND',
+            default='django_redis.cache.RedisCache'
+        ),
+        'LOCATION': os.getenv(
+            'SHOPPING_LIST_CACHE_LOCATION',
+            default='redis://redis:6379/3'
+        ),
+        'TIMEOUT': 60 * 60 * 24,
+    },
+}
+SHOPPING_LIST_CACHE = 'shopping_lists'
+
+# Время жизни кэша ответов для анонимных пользователей, в секундах
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', default=600))
+
+# Максимальное число подсказок при поиске ингредиента по названию
+INGREDIENT_SEARCH_LIMIT = int(
+    os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+# Фоновое создание PDF со списком покупок: число потоков на процесс,
+# размер очереди ожидающих заданий и время хранения результата
+SHOPPING_CART_JOB_WORKERS = int(
+    os.getenv('SHOPPING_CART_JOB_WORKERS', default=2))
+SHOPPING_CART_JOB_QUEUE = int(
+    os.getenv('SHOPPING_CART_JOB_QUEUE', default=20))
+SHOPPING_CART_JOB_TTL = int(os.getenv('SHOPPING_CART_JOB_TTL', default=600))
+# Состояние заданий и готовые файлы: кэш должен быть общим для всех
+# воркеров (Redis), с кэшем в памяти процесса PDF создается синхронно
+SHOPPING_CART_JOB_CACHE = 'jobs'
+
+# Загрузка изображений рецептов: предельный размер файла в байтах и
+# число пикселей, наибольшая сторона и качество JPEG после пересжатия,
+# число потоков на процесс и время ожидания обработки в секундах
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 2 ** 20))
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', default=40 * 10 ** 6))
+RECIPE_IMAGE_MAX_SIDE = int(os.getenv('RECIPE_IMAGE_MAX_SIDE', default=1600))
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', default=85))
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+RECIPE_IMAGE_TIMEOUT = int(os.getenv('RECIPE_IMAGE_TIMEOUT', default=30))
+
+# Замер запросов: доля запросов под замером (0 - выключен), порог
+# медленного запроса в мс и число выполнений одного SQL, начиная с
+# которого запрос попадает в лог как N+1
+REQUEST_TIMING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_TIMING_SAMPLE_RATE', default=0))
+REQUEST_TIMING_SLOW_MS = int(os.getenv('REQUEST_TIMING_SLOW_MS', default=500))
+REQUEST_TIMING_REPEATED_QUERIES = int(
+    os.getenv('REQUEST_TIMING_REPEATED_QUERIES', default=5))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -140,6 +220,8 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Имена загруженных файлов - хэши содержимого, URL файлов неизменны
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
 
 # User Model
 AUTH_USER_MODEL = 'users.CustomUser'
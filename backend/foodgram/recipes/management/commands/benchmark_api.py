@@ -0,0 +1,444 @@
+import base64
+import io
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+from http import HTTPStatus
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.management.commands.generate_dataset import BENCHMARK_PASSWORD
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Subscribe
+
+# clear - алиас кэша, очищаемого перед шагом; poll - повторять запрос,
+# пока ответ 202 (фоновое задание еще выполняется)
+Step = namedtuple('Step', ('name', 'method', 'url', 'data', 'clear', 'poll'),
+                  defaults=(None, False))
+POLL_INTERVAL = 0.05
+POLL_TIMEOUT = 30
+
+SIGNUP_EMAIL = 'benchmark-signup-{iteration}@example.com'
+DATASET_MODELS = (CustomUser, Recipe, RecipeIngredient, Ingredient, Tag,
+                  Favorite, ShoppingCart, Subscribe)
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга"""
+
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для замера эндпоинтов API тестовым клиентом
+    на данных generate_dataset: задержка p50/p95, число SQL-запросов
+    и пиковая память на запрос. Результат пишется в JSON для сравнения
+    """
+
+    help = 'Замер задержки, запросов к базе и памяти эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user',
+                            help='email пользователя, по умолчанию bench_0')
+        parser.add_argument('--password', default=BENCHMARK_PASSWORD,
+                            help='Пароль пользователя для входа по токену')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Число замеров каждого сценария')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Число прогревочных прогонов сценария')
+        parser.add_argument('--only', nargs='+', default=[],
+                            help='Запускать только сценарии с этими именами')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Очищать кэши перед каждым запросом')
+        parser.add_argument('--output', default='benchmark.json',
+                            help='Файл для результатов в JSON')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['warmup'] < 0:
+            raise CommandError('Неверное число повторов или прогревов')
+        self.cold_cache = options['cold_cache']
+        user = self.get_user(options['user'])
+        scenarios = self.get_scenarios(user, options['password'])
+        if options['only']:
+            scenarios = {
+                name: steps for name, steps in scenarios.items()
+                if name in options['only']
+            }
+            if not scenarios:
+                raise CommandError('Нет сценариев с такими именами')
+
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Окружение уже настроено, например, при запуске из тестов
+            teardown = False
+        else:
+            teardown = True
+        try:
+            results = {}
+            for name, steps in scenarios.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                results.update(self.run_scenario(
+                    steps, options['repeat'], options['warmup']))
+        finally:
+            CustomUser.objects.filter(email__startswith=SIGNUP_EMAIL.split(
+                '{')[0]).delete()
+            if teardown:
+                teardown_test_environment()
+
+        report = {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+                'warmup': options['warmup'],
+                'cold_cache': self.cold_cache,
+                'dataset': {
+                    model._meta.model_name: model.objects.count()
+                    for model in DATASET_MODELS
+                },
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2,
+                      sort_keys=True)
+        if options['compare']:
+            self.compare(options['compare'], results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Results saved to {options["output"]}'))
+
+    def get_user(self, email):
+        users = CustomUser.objects.filter(
+            email=email or 'bench_0@example.com')
+        user = users.first()
+        if user is None:
+            raise CommandError(
+                'Пользователь не найден, запустите generate_dataset')
+        return user
+
+    def get_scenarios(self, user, password):
+        """
+        Сценарии по всем эндпоинтам api/urls.py. Шаги сценария на запись
+        возвращают данные в исходное состояние; {created} в URL - id из
+        ответа предыдущего шага
+        """
+
+        recipes = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user).exclude(shopping_carts__user=user)
+        recipe_ids = list(recipes.order_by('pk').values_list(
+            'pk', flat=True)[:11])
+        author = CustomUser.objects.exclude(pk=user.pk).exclude(
+            following__user=user).order_by('pk').first()
+        tag = Tag.objects.order_by('pk').first()
+        ingredients = list(Ingredient.objects.order_by('pk')[:3])
+        if len(recipe_ids) < 11 or author is None or tag is None or len(
+                ingredients) < 3:
+            raise CommandError('Мало данных, запустите generate_dataset')
+        recipe, batch = recipe_ids[0], {'recipes': recipe_ids[1:]}
+        recipe_data = {
+            'name': 'Рецепт для замеров',
+            'text': 'Описание рецепта для замеров.',
+            'cooking_time': 15,
+            'tags': [tag.pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 100}
+                for ingredient in ingredients
+            ],
+            'image': self.get_image(),
+        }
+        patch_data = {
+            'cooking_time': 20,
+            'ingredients': recipe_data['ingredients'][:2],
+        }
+        signup_data = {
+            'email': SIGNUP_EMAIL,
+            'username': 'benchmark_signup_{iteration}',
+            'first_name': 'Замер',
+            'last_name': 'Регистрации',
+            'password': 'Kq7-pastry-Lime',
+        }
+        cart_url = '/api/recipes/download_shopping_cart/'
+        return {
+            'tags': [
+                Step('tags-list', 'get', '/api/tags/', None),
+                Step('tags-detail', 'get', f'/api/tags/{tag.pk}/', None),
+            ],
+            'ingredients': [
+                Step('ingredients-search', 'get',
+                     f'/api/ingredients/?name={ingredients[0].name[:3]}',
+                     None),
+                Step('ingredients-detail', 'get',
+                     f'/api/ingredients/{ingredients[0].pk}/', None),
+            ],
+            'recipes': [
+                Step('recipes-list', 'get', '/api/recipes/', None),
+                Step('recipes-list-tags', 'get',
+                     f'/api/recipes/?tags={tag.slug}', None),
+                Step('recipes-list-author', 'get',
+                     f'/api/recipes/?author={author.pk}', None),
+                Step('recipes-list-favorited', 'get',
+                     '/api/recipes/?is_favorited=1', None),
+                Step('recipes-list-in-cart', 'get',
+                     '/api/recipes/?is_in_shopping_cart=1', None),
+                Step('recipes-detail', 'get', f'/api/recipes/{recipe}/',
+                     None),
+            ],
+            'recipe-write': [
+                Step('recipes-create', 'post', '/api/recipes/', recipe_data),
+                Step('recipes-update', 'patch', '/api/recipes/{created}/',
+                     patch_data),
+                Step('recipes-delete', 'delete', '/api/recipes/{created}/',
+                     None),
+            ],
+            'favorite': [
+                Step('favorite-add', 'post',
+                     f'/api/recipes/{recipe}/favorite/', None),
+                Step('favorite-remove', 'delete',
+                     f'/api/recipes/{recipe}/favorite/', None),
+                Step('favorites-batch-add', 'post',
+                     '/api/recipes/favorite/', batch),
+                Step('favorites-batch-remove', 'delete',
+                     '/api/recipes/favorite/', batch),
+            ],
+            'shopping-cart': [
+                Step('shopping-cart-add', 'post',
+                     f'/api/recipes/{recipe}/shopping_cart/', None),
+                Step('shopping-cart-totals', 'get',
+                     '/api/recipes/shopping_cart/', None),
+                Step('shopping-cart-remove', 'delete',
+                     f'/api/recipes/{recipe}/shopping_cart/', None),
+                Step('shopping-cart-batch-add', 'post',
+                     '/api/recipes/shopping_cart/', batch),
+                Step('shopping-cart-batch-remove', 'delete',
+                     '/api/recipes/shopping_cart/', batch),
+            ],
+            'download': [
+                Step('download-pdf', 'get', f'{cart_url}?format=pdf', None),
+                Step('download-txt', 'get', f'{cart_url}?format=txt', None),
+                # Без очистки ответ берется из кэша списков после
+                # download-pdf, и задание не ставится в очередь
+                Step('download-async', 'get',
+                     f'{cart_url}?format=pdf&async=1', None,
+                     clear=settings.SHOPPING_LIST_CACHE),
+                Step('download-result', 'get', f'{cart_url}{{created}}/',
+                     None, poll=True),
+            ],
+            'users': [
+                Step('users-list', 'get', '/api/users/', None),
+                Step('users-detail', 'get', f'/api/users/{author.pk}/',
+                     None),
+                Step('users-me', 'get', '/api/users/me/', None),
+                Step('users-create', 'post', '/api/users/', signup_data),
+            ],
+            'subscriptions': [
+                Step('subscriptions', 'get',
+                     '/api/users/subscriptions/?recipes_limit=3', None),
+                Step('subscribe', 'post',
+                     f'/api/users/{author.pk}/subscribe/', None),
+                Step('unsubscribe', 'delete',
+                     f'/api/users/{author.pk}/subscribe/', None),
+            ],
+            'auth': [
+                Step('token-login', 'post', '/api/auth/token/login/',
+                     {'email': user.email, 'password': password}),
+                Step('token-logout', 'post', '/api/auth/token/logout/',
+                     None),
+                Step('set-password', 'post', '/api/users/set_password/',
+                     {'current_password': password,
+                      'new_password': password}),
+            ],
+        }
+
+    def get_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), '#8775D2').save(buffer, 'JPEG')
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/jpeg;base64,{encoded}'
+
+    def run_scenario(self, steps, repeat, warmup):
+        """
+        Время замеряется без инструментирования; запросы к базе и
+        память - в отдельном прогоне под CaptureQueriesContext и
+        tracemalloc, которые сами замедляют обработку запроса
+        """
+
+        timings = {step.name: [] for step in steps}
+        statuses = {step.name: set() for step in steps}
+        for iteration in range(warmup + repeat):
+            for step, elapsed, status in self.run_steps(steps, iteration):
+                statuses[step.name].add(status)
+                if iteration >= warmup and elapsed is not None:
+                    timings[step.name].append(elapsed)
+
+        profile = {
+            step.name: {'queries': None, 'memory_peak_kib': None}
+            for step in steps
+        }
+        for step, queries, peak in self.profile_steps(
+                steps, warmup + repeat):
+            profile[step.name] = {
+                'queries': queries,
+                'memory_peak_kib': round(peak / 1024, 1),
+            }
+
+        results = {}
+        for step in steps:
+            values = [elapsed * 1000 for elapsed in timings[step.name]]
+            result = {
+                'method': step.method.upper(),
+                'url': step.url,
+                'status': sorted(statuses[step.name], key=str),
+                'runs': len(values),
+                **profile[step.name],
+            }
+            if values:
+                result.update({
+                    'p50_ms': round(statistics.median(values), 2),
+                    'p95_ms': round(percentile(values, 95), 2),
+                    'min_ms': round(min(values), 2),
+                })
+            results[step.name] = result
+            self.write_result(step.name, result)
+        return results
+
+    def run_steps(self, steps, iteration):
+        state = {'iteration': iteration}
+        for step in steps:
+            request = self.prepare(step, state)
+            if request is None:
+                yield step, None, 'skipped'
+                continue
+            self.clear_before(step)
+            started = time.perf_counter()
+            response = self.request(*request, poll=step.poll)
+            elapsed = time.perf_counter() - started
+            self.update_state(state, response)
+            yield step, elapsed, response.status_code
+
+    def profile_steps(self, steps, iteration):
+        state = {'iteration': iteration}
+        for step in steps:
+            request = self.prepare(step, state)
+            if request is None:
+                continue
+            self.clear_before(step)
+            if step.poll:
+                # Запросы и память замеряются для готового результата
+                self.request(*request, poll=True)
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.request(*request)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.update_state(state, response)
+            yield step, len(queries), peak
+
+    def prepare(self, step, state):
+        """URL и данные шага с подставленными значениями из state"""
+
+        try:
+            url = step.url.format(**state)
+            data = step.data and {
+                key: value.format(**state) if isinstance(value, str)
+                else value
+                for key, value in step.data.items()
+            }
+        except KeyError:
+            return None
+        return step.method, url, data
+
+    def request(self, method, url, data, poll=False):
+        """
+        Запрос шага; с poll запрос повторяется, пока фоновое задание
+        не завершится, и время шага - время до готового результата
+        """
+
+        deadline = time.monotonic() + POLL_TIMEOUT
+        while True:
+            response = getattr(self.client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            if (not poll or response.status_code != HTTPStatus.ACCEPTED
+                    or time.monotonic() > deadline):
+                return response
+            time.sleep(POLL_INTERVAL)
+
+    def update_state(self, state, response):
+        if response.get('Content-Type') != 'application/json':
+            return
+        data = response.json()
+        if isinstance(data, dict) and 'id' in data:
+            state['created'] = data['id']
+
+    def clear_before(self, step):
+        """
+        Очистка кэшей перед шагом; перед шагом, которому нужен результат
+        предыдущего, кэш не очищается: в нем хранятся фоновые задания
+        """
+
+        if self.cold_cache and '{created}' not in step.url:
+            self.clear_caches()
+        elif step.clear:
+            caches[step.clear].clear()
+
+    def clear_caches(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def write_result(self, name, result):
+        if 'p50_ms' not in result:
+            self.stdout.write(f'  {name:<28} skipped')
+            return
+        status = ','.join(map(str, result['status']))
+        line = (
+            f'  {name:<28} p50 {result["p50_ms"]:>8.2f} ms  '
+            f'p95 {result["p95_ms"]:>8.2f} ms  '
+            f'{result["queries"]:>3} queries  '
+            f'{result["memory_peak_kib"]:>8.1f} KiB  [{status}]'
+        )
+        if any(isinstance(code, int) and code >= 400
+               for code in result['status']):
+            line = self.style.WARNING(line)
+        self.stdout.write(line)
+
+    def compare(self, path, results):
+        """Изменение p50 и числа запросов относительно прошлого прогона"""
+
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Compared to {path}'))
+        for name, result in results.items():
+            old = previous.get(name)
+            if not old or 'p50_ms' not in old or 'p50_ms' not in result:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / max(
+                old['p50_ms'], 1e-6) * 100
+            queries = (result['queries'] or 0) - (old['queries'] or 0)
+            self.stdout.write(
+                f'  {name:<28} p50 {old["p50_ms"]:>8.2f} -> '
+                f'{result["p50_ms"]:>8.2f} ms ({change:+.0f}%)  '
+                f'queries {queries:+d}'
+            )
@@ -0,0 +1,54 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from api.utils.utils import get_renderer
+
+
+class Command(BaseCommand):
+    """Кастомная команда для замера скорости создания списка покупок в PDF"""
+
+    help = 'Замер времени и пиковой памяти рендеринга PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Количество позиций в списке покупок'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Число повторов для каждого размера'
+        )
+
+    def handle(self, *args, **options):
+        renderer = get_renderer()
+        for size in options['sizes']:
+            items = [
+                {
+                    'ingredient__name': f'Ингредиент номер {num}',
+                    'ingredient__measurement_unit': 'г',
+                    'ingredient_total': num,
+                }
+                for num in range(1, size + 1)
+            ]
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                pdf = renderer.render(items, 'Список покупок')
+                timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            renderer.render(items, 'Список покупок')
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(
+                f'{size:>6} items: best {min(timings) * 1000:.1f} ms, '
+                f'mean {sum(timings) / len(timings) * 1000:.1f} ms, '
+                f'peak {peak / 1024:.0f} KiB, '
+                f'size {len(pdf.getvalue()) / 1024:.0f} KiB'
+            )
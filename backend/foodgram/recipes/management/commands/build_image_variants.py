@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import (RECIPES_GENERATION, REFERENCE_GENERATION,
+                       bump_generations)
+from api.images import create_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для создания вариантов изображений
+    (миниатюр и карточек) для уже загруженных рецептов; заодно
+    отмечает в кэше готовность уже существующих вариантов
+    """
+
+    help = 'Создание вариантов изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать уже существующие варианты'
+        )
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True).distinct().order_by('image')
+        created = failed = 0
+        for checked, name in enumerate(names.iterator(), start=1):
+            try:
+                created += create_image_variants(
+                    name, overwrite=options['force'])
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+            if checked % 100 == 0:
+                self.stdout.write(f'{checked} images checked')
+        bump_generations(RECIPES_GENERATION, REFERENCE_GENERATION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Image variants built: {created} created, {failed} failed'))
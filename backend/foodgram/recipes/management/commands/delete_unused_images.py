@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.images import delete_unused_images
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для удаления изображений, на которые больше
+    не ссылается ни один рецепт; запускается периодически (cron)
+    """
+
+    help = 'Удаление неиспользуемых изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=60,
+            help='Не удалять файлы, измененные за последние N минут'
+        )
+
+    def handle(self, *args, **options):
+        deleted = delete_unused_images(timedelta(minutes=options['grace']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Unused image files deleted: {deleted}'))
@@ -0,0 +1,146 @@
+import json
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.filters import RecipeFilter
+from api.querysets import (limited_recipes_queryset, recipe_feed_queryset,
+                           shopping_cart_totals, subscriptions_queryset)
+from recipes.models import Tag
+from users.models import CustomUser
+
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)')
+SQLITE_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда: EXPLAIN для самых частых запросов API.
+    Завершается ошибкой, если в плане есть последовательное чтение
+    или сортировка таблицы больше заданного размера
+    """
+
+    help = 'Проверка планов выполнения горячих запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=10000,
+            help='Размер таблицы, начиная с которого Seq Scan/Sort - ошибка'
+        )
+        parser.add_argument(
+            '--user',
+            help='email пользователя, от имени которого строятся запросы'
+        )
+
+    def handle(self, *args, **options):
+        self.min_rows = options['min_rows']
+        self.table_sizes = {}
+        user = self.get_user(options['user'])
+        problems = []
+        for name, queryset in self.get_hot_querysets(user):
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            problems += [
+                f'{name}: {problem}' for problem in self.check_plan(queryset)
+            ]
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Query plans are fine!'))
+
+    def get_user(self, email):
+        users = CustomUser.objects.all()
+        if email:
+            users = users.filter(email=email)
+        user = users.first()
+        if user is None:
+            raise CommandError('Нет пользователя для построения запросов')
+        return user
+
+    def get_hot_querysets(self, user):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        feed = recipe_feed_queryset(user)
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        tag_filter = RecipeFilter(data={'tags': tags}, queryset=feed).qs
+        subscriptions = subscriptions_queryset(user).order_by(
+            '-date_joined', '-id')[:page_size]
+        authors = list(subscriptions.values_list('pk', flat=True))
+        return [
+            ('recipe feed', feed.order_by('-pub_date', '-id')[:page_size]),
+            ('tag filter',
+             tag_filter.order_by('-pub_date', '-id')[:page_size]),
+            ('shopping cart', shopping_cart_totals(user)),
+            ('subscriptions', subscriptions),
+            ('subscription recipes', limited_recipes_queryset(
+                authors, 3).order_by('-pub_date', '-id')),
+        ]
+
+    def check_plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            plan = self.explain_postgresql(queryset)
+            self.stdout.write(json.dumps(plan, indent=2))
+            return self.check_postgresql_node(plan[0]['Plan'])
+        plan = queryset.explain()
+        self.stdout.write(plan)
+        return self.check_plan_text(plan, queryset)
+
+    def explain_postgresql(self, queryset):
+        """
+        План в JSON напрямую через курсор: QuerySet.explain() на
+        Django 2.2 отдает str() уже декодированного psycopg2 списка
+        """
+
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def check_postgresql_node(self, node):
+        problems = []
+        table = node.get('Relation Name')
+        if (node['Node Type'] == 'Seq Scan'
+                and self.get_table_size(table) >= self.min_rows):
+            problems.append(f'Seq Scan on {table}')
+        if (node['Node Type'] == 'Sort'
+                and node.get('Plan Rows', 0) >= self.min_rows):
+            problems.append(f'Sort of {node["Plan Rows"]} rows')
+        for child in node.get('Plans', ()):
+            problems += self.check_postgresql_node(child)
+        return problems
+
+    def check_plan_text(self, plan, queryset):
+        """
+        Текстовый план SQLite не содержит оценок строк: сортировка
+        считается проблемой только для постраничных выборок
+        """
+
+        problems = [
+            f'Seq Scan on {table}'
+            for table in SQLITE_SCAN.findall(plan)
+            if self.get_table_size(table) >= self.min_rows
+        ]
+        main_table = queryset.model._meta.db_table
+        if (SQLITE_SORT in plan and queryset.query.high_mark is not None
+                and self.get_table_size(main_table) >= self.min_rows):
+            problems.append(f'Sort on {main_table}')
+        return problems
+
+    def get_table_size(self, table):
+        if table not in self.table_sizes:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE relname = %s',
+                        [table]
+                    )
+                elif table in connection.introspection.table_names(cursor):
+                    cursor.execute('SELECT COUNT(*) FROM {}'.format(
+                        connection.ops.quote_name(table)))
+                else:
+                    cursor.execute('SELECT NULL')
+                row = cursor.fetchone()
+            self.table_sizes[table] = int(row[0] or 0) if row else 0
+        return self.table_sizes[table]
@@ -0,0 +1,228 @@
+import io
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from api.cache import (INGREDIENTS_GENERATION, RECIPES_GENERATION,
+                       REFERENCE_GENERATION, TAGS_GENERATION,
+                       bump_generations)
+from api.images import create_image_variants
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser, Subscribe
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для наполнения базы синтетическими данными:
+    пользователи, рецепты с ингредиентами и тегами, избранное,
+    списки покупок и подписки. Одно и то же зерно дает тот же набор
+    """
+
+    help = 'Генерация воспроизводимого набора данных для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes-per-user', type=int, default=10,
+                            help='Количество рецептов у пользователя')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Количество ингредиентов в рецепте')
+        parser.add_argument('--tags-per-recipe', type=int, default=2,
+                            help='Количество тегов у рецепта')
+        parser.add_argument('--favorites-per-user', type=int, default=20,
+                            help='Количество рецептов в избранном')
+        parser.add_argument('--carts-per-user', type=int, default=5,
+                            help='Количество рецептов в списке покупок')
+        parser.add_argument('--subscriptions-per-user', type=int, default=10,
+                            help='Количество подписок у пользователя')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument('--prefix', default='bench',
+                            help='Префикс имен синтетических пользователей')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество строк в одном bulk_create')
+        parser.add_argument('--flush', action='store_true',
+                            help='Удалить ранее созданные данные с префиксом')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        if options['users'] < 1 or self.batch_size < 1:
+            raise CommandError(
+                'Количество пользователей и размер пачки '
+                'должны быть положительными'
+            )
+        existing = CustomUser.objects.filter(username__startswith=f'{prefix}_')
+        if existing.exists():
+            if not options['flush']:
+                raise CommandError(
+                    f'Пользователи с префиксом {prefix} уже есть, '
+                    f'используйте --flush'
+                )
+            self.stdout.write(f'{existing.delete()[0]} objects deleted')
+
+        started = time.monotonic()
+        tag_ids = self.get_tags(options['tags_per_recipe'])
+        ingredient_ids = self.get_ingredients(
+            options['ingredients_per_recipe'])
+        user_ids = self.create_users(prefix, options['users'])
+        recipe_ids = self.create_recipes(
+            user_ids, options['recipes_per_user'], self.create_image())
+        self.create_recipe_relations(
+            recipe_ids, tag_ids, options['tags_per_recipe'],
+            ingredient_ids, options['ingredients_per_recipe'])
+        self.create_user_relations(
+            Favorite, 'recipe_id', user_ids, recipe_ids,
+            options['favorites_per_user'])
+        self.create_user_relations(
+            ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+            options['carts_per_user'])
+        self.create_user_relations(
+            Subscribe, 'author_id', user_ids, user_ids,
+            options['subscriptions_per_user'])
+
+        # bulk_create не вызывает сигналы: счетчики и итоги списков
+        # покупок досчитываются командами сверки
+        call_command('reconcile_counters', batch_size=self.batch_size,
+                     stdout=io.StringIO())
+        call_command('rebuild_cart_totals', stdout=io.StringIO())
+        bump_generations(RECIPES_GENERATION, REFERENCE_GENERATION,
+                         INGREDIENTS_GENERATION, TAGS_GENERATION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset generated in {time.monotonic() - started:.1f}s: '
+            f'{len(user_ids)} users, {len(recipe_ids)} recipes. '
+            f'Password: {BENCHMARK_PASSWORD}'
+        ))
+
+    def bulk_create(self, model, objects):
+        """Объекты создаются пачками по batch_size в одной транзакции"""
+
+        objects = iter(objects)
+        total = 0
+        while True:
+            batch = []
+            for obj in objects:
+                batch.append(obj)
+                if len(batch) == self.batch_size:
+                    break
+            if not batch:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {total}')
+        return total
+
+    def sample(self, population, size, exclude=None):
+        """Случайные size элементов, без копирования всей выборки"""
+
+        sample = self.rng.sample(
+            population, min(size + (exclude is not None), len(population)))
+        return [item for item in sample if item != exclude][:size]
+
+    def get_tags(self, size):
+        """Недостающие теги создаются, чтобы у рецептов было из чего брать"""
+
+        for number in range(Tag.objects.count(), size):
+            Tag.objects.get_or_create(
+                slug=f'bench-{number}',
+                defaults={
+                    'name': f'Тег {number}',
+                    'color': f'#{number:06X}',
+                }
+            )
+        return list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+
+    def get_ingredients(self, size):
+        """Если справочник пуст, создаются синтетические ингредиенты"""
+
+        if Ingredient.objects.count() < size:
+            self.bulk_create(Ingredient, (
+                Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+                for number in range(size * 10)
+            ))
+        return list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True))
+
+    def create_users(self, prefix, count):
+        # Хэш пароля считается один раз: PBKDF2 для каждого
+        # пользователя занял бы большую часть времени генерации
+        password = make_password(BENCHMARK_PASSWORD)
+        self.bulk_create(CustomUser, (
+            CustomUser(
+                username=f'{prefix}_{number}',
+                email=f'{prefix}_{number}@example.com',
+                first_name='Пользователь',
+                last_name=str(number),
+                password=password,
+            )
+            for number in range(count)
+        ))
+        return list(CustomUser.objects.filter(
+            username__startswith=f'{prefix}_').order_by('pk').values_list(
+                'pk', flat=True))
+
+    def create_image(self):
+        """Одно изображение на все рецепты: файлы хранятся по хэшу"""
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (480, 360), '#49B64E').save(buffer, 'JPEG')
+        name = default_storage.save(
+            'image/recipes/benchmark.jpg', ContentFile(buffer.getvalue()))
+        create_image_variants(name)
+        return name
+
+    def create_recipes(self, user_ids, recipes_per_user, image):
+        self.bulk_create(Recipe, (
+            Recipe(
+                author_id=user_id,
+                name=f'Рецепт {number}',
+                text='Описание синтетического рецепта. ' * 5,
+                image=image,
+                cooking_time=self.rng.randint(1, 180),
+            )
+            for user_id in user_ids
+            for number in range(recipes_per_user)
+        ))
+        return list(Recipe.objects.filter(
+            author_id__in=user_ids).order_by('pk').values_list(
+                'pk', flat=True))
+
+    def create_recipe_relations(self, recipe_ids, tag_ids, tags_per_recipe,
+                                ingredient_ids, ingredients_per_recipe):
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.sample(tag_ids, tags_per_recipe)
+        ))
+        self.bulk_create(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=self.rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(
+                ingredient_ids, ingredients_per_recipe)
+        ))
+
+    def create_user_relations(self, model, field, user_ids, targets, size):
+        """Каждый пользователь связывается с size случайными объектами"""
+
+        self.bulk_create(model, (
+            model(user_id=user_id, **{field: target})
+            for user_id in user_ids
+            for target in self.sample(
+                targets, size, user_id if model is Subscribe else None)
+        ))
@@ -1,23 +1,255 @@
 import csv
+import io
+import os
+import time
+from collections import namedtuple
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
-from recipes.models import Ingredient
+from api.cache import (INGREDIENTS_GENERATION, RECIPES_GENERATION,
+                       REFERENCE_GENERATION, TAGS_GENERATION,
+                       bump_generations)
+from recipes.models import Ingredient, Tag
+
+Target = namedtuple('Target', ('model', 'fields', 'key', 'generations'))
+
+TARGETS = {
+    'ingredients': Target(
+        Ingredient,
+        ('name', 'measurement_unit'),
+        ('name', 'measurement_unit'),
+        (RECIPES_GENERATION, REFERENCE_GENERATION, INGREDIENTS_GENERATION)
+    ),
+    'tags': Target(
+        Tag,
+        ('name', 'slug', 'color'),
+        ('slug',),
+        (RECIPES_GENERATION, REFERENCE_GENERATION, TAGS_GENERATION)
+    ),
+}
+TEMP_TABLE = 'load_from_csv'
 
 
 class Command(BaseCommand):
-    """Кастомная команда для выгрузки данных из csv-файла"""
+    """
+    Кастомная команда для загрузки справочников из csv-файла.
+    Файл читается потоком, пачками; уже существующие записи
+    пропускаются или обновляются, поэтому загрузку можно повторять
+    """
+
+    help = 'Загрузка ингредиентов или тегов из csv-файла'
 
-    help = 'Загрузка ингредиентов в таблицу'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            help='Путь к csv-файлу, по умолчанию data/<model>.csv'
+        )
+        parser.add_argument(
+            '--model',
+            choices=TARGETS,
+            default='ingredients',
+            help='Справочник, в который загружаются строки'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной пачке'
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Обновлять поля уже существующих записей'
+        )
+        parser.add_argument(
+            '--skip-header',
+            action='store_true',
+            help='Первая строка файла - заголовок'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY на PostgreSQL'
+        )
 
     def handle(self, *args, **options):
-        number = Ingredient.objects.count()
-        reader = csv.DictReader(
-            open('./data/ingredients.csv'),
-            fieldnames=['name', 'measurement_unit']
+        target = TARGETS[options['model']]
+        path = options['path'] or os.path.join(
+            settings.BASE_DIR, 'data', f'{options["model"]}.csv')
+        if not os.path.isfile(path):
+            raise CommandError(f'Файл {path} не найден')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть положительным')
+
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                read, created, updated = self.load_postgresql(
+                    target, file, options['batch_size'], options['update'],
+                    options['skip_header'], started)
+            else:
+                read, created, updated = self.load_batches(
+                    target, file, options['batch_size'], options['update'],
+                    options['skip_header'], started)
+        elapsed = time.monotonic() - started
+        bump_generations(*target.generations)
+        self.stdout.write(self.style.SUCCESS(
+            f'Loading complete! {read} rows read, {created} created, '
+            f'{updated} updated in {elapsed:.2f}s '
+            f'({read / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
+
+    def load_batches(self, target, file, batch_size, update, skip_header,
+                     started):
+        """Пачки строк записываются через bulk_create и bulk_update"""
+
+        reader = csv.reader(file)
+        if skip_header:
+            next(reader, None)
+        read = created = updated = 0
+        while True:
+            rows = list(islice(reader, batch_size))
+            if not rows:
+                break
+            batch_created, batch_updated = self.write_batch(
+                target, self.parse_rows(target, rows, read), update)
+            read += len(rows)
+            created += batch_created
+            updated += batch_updated
+            self.report_progress(read, started)
+        return read, created, updated
+
+    def report_progress(self, read, started):
+        self.stdout.write(
+            f'{read} rows read '
+            f'({read / max(time.monotonic() - started, 1e-6):.0f} rows/s)'
         )
-        Ingredient.objects.bulk_create([Ingredient(**data) for data in reader])
-        if (Ingredient.objects.count() > number):
-            self.stdout.write(self.style.SUCCESS('Loading complete!'))
+
+    def check_row(self, target, row, number):
+        if len(row) != len(target.fields):
+            raise CommandError(
+                f'Строка {number}: ожидалось {len(target.fields)} '
+                f'колонки, получено {len(row)}'
+            )
+
+    def parse_rows(self, target, rows, offset):
+        """Строки с ключом: при повторе ключа в пачке берется последняя"""
+
+        parsed = {}
+        for number, row in enumerate(rows, start=offset + 1):
+            self.check_row(target, row, number)
+            values = dict(zip(target.fields, map(str.strip, row)))
+            parsed[tuple(values[field] for field in target.key)] = values
+        return parsed
+
+    @transaction.atomic
+    def write_batch(self, target, rows, update):
+        model = target.model
+        first_key = target.key[0]
+        existing = {
+            tuple(getattr(obj, field) for field in target.key): obj
+            for obj in model.objects.filter(**{
+                f'{first_key}__in': {key[0] for key in rows}})
+        }
+        to_create, to_update = [], []
+        for key, values in rows.items():
+            obj = existing.get(key)
+            if obj is None:
+                to_create.append(model(**values))
+            elif update and any(
+                    getattr(obj, field) != value
+                    for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                to_update.append(obj)
+        model.objects.bulk_create(to_create, ignore_conflicts=True)
+        update_fields = [
+            field for field in target.fields if field not in target.key]
+        if update_fields:
+            model.objects.bulk_update(to_update, update_fields)
         else:
-            self.stdout.write(self.style.ERROR('Oops! Crashing!'))
+            to_update = []
+        return len(to_create), len(to_update)
+
+    @transaction.atomic
+    def load_postgresql(self, target, file, batch_size, update, skip_header,
+                        started):
+        """
+        Пачки строк передаются через COPY FROM STDIN во временную
+        таблицу, откуда одним INSERT ... ON CONFLICT переносятся в
+        справочник: существующие записи пропускаются или обновляются.
+        При повторе ключа, как и в пачках, берется последняя строка
+        """
+
+        quote = connection.ops.quote_name
+        model = target.model
+        columns = [
+            quote(model._meta.get_field(field).column)
+            for field in target.fields
+        ]
+        key_columns = [
+            quote(model._meta.get_field(field).column)
+            for field in target.key
+        ]
+        update_columns = [
+            column for column in columns if column not in key_columns]
+        table = quote(model._meta.db_table)
+        temp_table = quote(TEMP_TABLE)
+        reader = csv.reader(file)
+        if skip_header:
+            next(reader, None)
+        read = 0
+        with connection.cursor() as cursor:
+            # Порядковый номер заполняется в порядке строк файла
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {temp_table} (row_number bigserial, '
+                f'{", ".join(f"{column} text" for column in columns)}) '
+                f'ON COMMIT DROP'
+            )
+            while True:
+                rows = list(islice(reader, batch_size))
+                if not rows:
+                    break
+                for number, row in enumerate(rows, start=read + 1):
+                    self.check_row(target, row, number)
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {temp_table} ({", ".join(columns)}) FROM STDIN '
+                    f'WITH (FORMAT csv)',
+                    buffer
+                )
+                read += len(rows)
+                self.report_progress(read, started)
+            if update and update_columns:
+                assignments = ', '.join(
+                    f'{column} = EXCLUDED.{column}'
+                    for column in update_columns)
+                changed = ' OR '.join(
+                    f'{table}.{column} IS DISTINCT FROM EXCLUDED.{column}'
+                    for column in update_columns)
+                conflict = (f'({", ".join(key_columns)}) DO UPDATE '
+                            f'SET {assignments} WHERE {changed}')
+            else:
+                conflict = 'DO NOTHING'
+            trimmed = [f'btrim({column})' for column in columns]
+            trimmed_key = ', '.join(
+                f'btrim({column})' for column in key_columns)
+            # xmax = 0 только у вставленных, а не обновленных строк
+            cursor.execute(
+                f'WITH written AS (INSERT INTO {table} '
+                f'({", ".join(columns)}) '
+                f'SELECT DISTINCT ON ({trimmed_key}) '
+                f'{", ".join(trimmed)} FROM {temp_table} '
+                f'ORDER BY {trimmed_key}, row_number DESC '
+                f'ON CONFLICT {conflict} RETURNING (xmax = 0) AS inserted) '
+                f'SELECT COUNT(*) FILTER (WHERE inserted), '
+                f'COUNT(*) FILTER (WHERE NOT inserted) FROM written'
+            )
+            created, updated = cursor.fetchone()
+        return read, created, updated
@@ -0,0 +1,83 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Min
+
+from api.cache import (INGREDIENTS_GENERATION, RECIPES_GENERATION,
+                       REFERENCE_GENERATION, bump_generations)
+from recipes.models import Ingredient, RecipeIngredient, ShoppingCartTotal
+
+
+def merge_rows(model, owner, amount, ingredient_ids, keep_id):
+    """
+    Строки model, ссылающиеся на дубли, переносятся на ingredient keep_id;
+    если у владельца (рецепта, пользователя) их несколько, остается одна
+    строка с суммой количеств. Возвращает число перенесенных строк
+    """
+
+    rows = defaultdict(list)
+    for row in model.objects.select_for_update().filter(
+            ingredient_id__in=ingredient_ids).order_by('pk'):
+        rows[getattr(row, f'{owner}_id')].append(row)
+    to_delete, to_update = [], []
+    for owner_rows in rows.values():
+        owner_rows.sort(key=lambda row: row.ingredient_id != keep_id)
+        kept, *merged = owner_rows
+        if not merged and kept.ingredient_id == keep_id:
+            continue
+        setattr(kept, amount, sum(getattr(row, amount) for row in owner_rows))
+        kept.ingredient_id = keep_id
+        to_update.append(kept)
+        to_delete.extend(row.pk for row in merged)
+    model.objects.filter(pk__in=to_delete).delete()
+    model.objects.bulk_update(to_update, ('ingredient', amount))
+    return len(to_update) + len(to_delete)
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для объединения одинаковых ингредиентов (название и
+    единицы измерения): запускается перед migrate, который добавляет
+    ограничение unique_ingredient. Рецепты и итоги списков покупок
+    переносятся на ингредиент с наименьшим id, количества суммируются
+    """
+
+    help = 'Объединение повторяющихся ингредиентов'
+
+    def handle(self, *args, **options):
+        tables = connection.introspection.table_names()
+        if Ingredient._meta.db_table not in tables:
+            self.stdout.write('Ingredients table does not exist yet')
+            return
+        duplicates = Ingredient.objects.values(
+            'name', 'measurement_unit').annotate(
+                keep_id=Min('pk'), count=Count('pk')).filter(
+                    count__gt=1).order_by('keep_id')
+        # До migrate таблицы итогов списков покупок может еще не быть
+        merge_totals = ShoppingCartTotal._meta.db_table in tables
+        merged = moved = 0
+        for duplicate in list(duplicates):
+            with transaction.atomic():
+                ingredients = Ingredient.objects.select_for_update().filter(
+                    name=duplicate['name'],
+                    measurement_unit=duplicate['measurement_unit']
+                ).order_by('pk')
+                ingredient_ids = list(ingredients.values_list('pk', flat=True))
+                keep_id, *duplicate_ids = ingredient_ids
+                moved += merge_rows(RecipeIngredient, 'recipe', 'amount',
+                                    ingredient_ids, keep_id)
+                if merge_totals:
+                    moved += merge_rows(ShoppingCartTotal, 'user', 'total',
+                                        ingredient_ids, keep_id)
+                Ingredient.objects.filter(pk__in=duplicate_ids).delete()
+            merged += len(duplicate_ids)
+            self.stdout.write(
+                f'{duplicate["name"]} ({duplicate["measurement_unit"]}): '
+                f'{len(duplicate_ids)} merged')
+        if merged:
+            bump_generations(RECIPES_GENERATION, REFERENCE_GENERATION,
+                             INGREDIENTS_GENERATION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingredients merged: {merged} duplicates removed, '
+            f'{moved} rows moved'))
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingCartTotal
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для сверки итогов списков покупок
+    с корзинами и ингредиентами рецептов
+    """
+
+    help = 'Пересчет таблицы итогов списков покупок пачками пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество пользователей в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = ShoppingCart.objects.values_list(
+            'user_id', flat=True).union(ShoppingCartTotal.objects.values_list(
+                'user_id', flat=True)).order_by('user_id')
+        user_ids = list(user_ids)
+        created = updated = deleted = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                batch_created, batch_updated, batch_deleted = (
+                    self.reconcile(batch))
+            created += batch_created
+            updated += batch_updated
+            deleted += batch_deleted
+            self.stdout.write(
+                f'{start + len(batch)}/{len(user_ids)} users checked')
+        self.stdout.write(self.style.SUCCESS(
+            f'Cart totals rebuilt: {created} created, '
+            f'{updated} updated, {deleted} deleted'
+        ))
+
+    def reconcile(self, user_ids):
+        """
+        Строки пользователей блокируются до чтения корзин, в том же
+        порядке, что и в apply_cart_deltas: параллельное изменение
+        корзины ждет окончания сверки и не теряется
+        """
+
+        list(CustomUser.objects.select_for_update().filter(
+            pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+        expected = {
+            (row['recipe__shopping_carts__user_id'],
+             row['ingredient_id']): row['total']
+            for row in RecipeIngredient.objects.filter(
+                recipe__shopping_carts__user_id__in=user_ids).values(
+                    'recipe__shopping_carts__user_id',
+                    'ingredient_id').annotate(total=Sum('amount'))
+        }
+        to_update, to_delete = [], []
+        for total in ShoppingCartTotal.objects.filter(user_id__in=user_ids):
+            value = expected.pop((total.user_id, total.ingredient_id), None)
+            if value is None:
+                to_delete.append(total.pk)
+            elif value != total.total:
+                total.total = value
+                to_update.append(total)
+        to_create = [
+            ShoppingCartTotal(
+                user_id=user_id, ingredient_id=ingredient_id, total=value)
+            for (user_id, ingredient_id), value in expected.items()
+        ]
+        ShoppingCartTotal.objects.bulk_create(to_create)
+        ShoppingCartTotal.objects.bulk_update(to_update, ['total'])
+        ShoppingCartTotal.objects.filter(pk__in=to_delete).delete()
+        return len(to_create), len(to_update), len(to_delete)
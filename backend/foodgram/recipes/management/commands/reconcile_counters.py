@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import CustomUser
+
+
+def count_subquery(model, field):
+    """Число строк model, ссылающихся на текущий объект через field"""
+
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+class Command(BaseCommand):
+    """
+    Кастомная команда для сверки счетчиков избранного и списков
+    покупок у рецептов и количества рецептов у авторов
+    """
+
+    help = 'Пересчет денормализованных счетчиков пачками объектов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество объектов в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = self.reconcile(Recipe, batch_size, {
+            'favorites_count': count_subquery(Favorite, 'recipe'),
+            'in_carts_count': count_subquery(ShoppingCart, 'recipe'),
+        })
+        authors = self.reconcile(CustomUser, batch_size, {
+            'recipes_count': count_subquery(Recipe, 'author'),
+        })
+        self.stdout.write(self.style.SUCCESS(
+            f'Counters reconciled: {recipes} recipes and '
+            f'{authors} users fixed'
+        ))
+
+    def reconcile(self, model, batch_size, counters):
+        """
+        Объекты читаются пачками по возрастанию pk с блокировкой строк,
+        расходящиеся счетчики исправляются одним bulk_update на пачку
+        """
+
+        annotations = {
+            f'actual_{field}': expression
+            for field, expression in counters.items()
+        }
+        fixed = checked = last_pk = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    model.objects.select_for_update().filter(
+                        pk__gt=last_pk).order_by('pk').annotate(
+                            **annotations)[:batch_size]
+                )
+                if not batch:
+                    break
+                to_update = []
+                for obj in batch:
+                    changed = False
+                    for field in counters:
+                        actual = getattr(obj, f'actual_{field}')
+                        if getattr(obj, field) != actual:
+                            setattr(obj, field, actual)
+                            changed = True
+                    if changed:
+                        to_update.append(obj)
+                model.objects.bulk_update(to_update, list(counters))
+            fixed += len(to_update)
+            checked += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {checked} checked')
+        return fixed
@@ -3,7 +3,7 @@ import textwrap
 from django.core.validators import MinValueValidator
 from django.db import models
 
-from users.models import CustomUser
+from users.models import CounterFieldsMixin, CustomUser
 
 
 class Tag(models.Model):
@@ -45,12 +45,26 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
+        # Поиск в админке по началу названия: LIKE 'x%' на PostgreSQL
+        indexes = [
+            models.Index(
+                fields=('name',),
+                name='ingredient_name_like_idx',
+                opclasses=('varchar_pattern_ops',)
+            ),
+        ]
 
     def __str__(self) -> str:
         return textwrap.shorten(self.name, width=30)
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецепта"""
 
     author = models.ForeignKey(
@@ -83,6 +97,26 @@ class Recipe(models.Model):
         Ingredient,
         through='RecipeIngredient'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    # Меняется при каждом изменении ингредиентов рецепта: входит
+    # в отпечаток корзины для кэша готовых списков покупок
+    ingredients_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия ингредиентов'
+    )
+
+    counter_fields = ('favorites_count', 'in_carts_count',
+                      'ingredients_version')
 
     class Meta:
         ordering = ['-pub_date']
@@ -94,6 +128,21 @@ class Recipe(models.Model):
                 name='unique_recipes'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('name',),
+                name='recipe_name_like_idx',
+                opclasses=('varchar_pattern_ops',)
+            ),
+        ]
 
     def __str__(self) -> str:
         return textwrap.shorten(self.name, width=30)
@@ -192,3 +241,37 @@ class ShoppingCart(models.Model):
 
     def __str__(self) -> str:
         return "{}_{}".format(self.user, self.recipe)
+
+
+class ShoppingCartTotal(models.Model):
+    """
+    Суммарное количество ингредиента в корзине пользователя.
+    Поддерживается при изменении корзины и ингредиентов рецептов
+    """
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент'
+    )
+    total = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_totals'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return "{}_{}".format(self.user_id, self.ingredient_id)
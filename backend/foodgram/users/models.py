@@ -4,7 +4,26 @@ from django.db import models
 from django.utils import timezone
 
 
-class CustomUser(AbstractUser):
+class CounterFieldsMixin:
+    """
+    Поля-счетчики меняются только запросами UPDATE с F(): обычный
+    save() существующего объекта их не перезаписывает, иначе
+    устаревшее значение из памяти затерло бы параллельные изменения
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class CustomUser(CounterFieldsMixin, AbstractUser):
     """Кастомная модель пользователя на базе AbstractUser"""
 
     username = models.CharField(
@@ -25,6 +44,15 @@ class CustomUser(AbstractUser):
         default=timezone.now,
         verbose_name='Дата регистрации'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+
+    counter_fields = ('recipes_count',)
+    # Поля, которые показываются в рецептах как данные автора
+    public_fields = ('username', 'email', 'first_name', 'last_name')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name', 'password']
@@ -39,6 +67,38 @@ class CustomUser(AbstractUser):
                 name='unique_custom_user'
             )
         ]
+        # Поиск в админке по началу имени и почты: LIKE 'x%' на PostgreSQL
+        indexes = [
+            models.Index(
+                fields=['username'],
+                name='user_username_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+            models.Index(
+                fields=['email'],
+                name='user_email_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_public_fields()
+        return instance
+
+    def remember_public_fields(self):
+        """Значения публичных полей, сохраненные в базе"""
+
+        self._saved_public_fields = {
+            field: self.__dict__.get(field) for field in self.public_fields
+        }
+
+    def public_fields_changed(self):
+        saved = getattr(self, '_saved_public_fields', None)
+        return saved is None or any(
+            self.__dict__.get(field) != value
+            for field, value in saved.items())
 
     def __str__(self) -> str:
         return "{}_{}".format(self.username, self.email)
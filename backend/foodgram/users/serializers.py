@@ -1,8 +1,8 @@
 from djoser.serializers import SetPasswordSerializer, UserCreateSerializer
-from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
+from api.images import ImageVariantMixin, ImageVariantsField
 from recipes.models import Recipe
 from users.models import CustomUser, Subscribe
 
@@ -16,6 +16,9 @@ class IsSubscribed(metaclass=serializers.SerializerMetaclass):
     is_subscribed = SerializerMethodField()
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
@@ -66,19 +69,21 @@ class UserSetPasswordSerializer(SetPasswordSerializer):
         fields = ('new_password', 'current_password')
 
 
-class RecipeShortSerializer(ModelSerializer):
+class RecipeShortSerializer(ImageVariantMixin, ModelSerializer):
     """Усеченный сериализатор для Рецептов"""
 
+    image_variants = ImageVariantsField(source='image')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscribeSerializer(ModelSerializer, IsSubscribed):
     """Сериализатор для Подписок"""
 
     recipes = SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='recipes.count')
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = CustomUser
@@ -86,11 +91,10 @@ class SubscribeSerializer(ModelSerializer, IsSubscribed):
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        author = get_object_or_404(CustomUser, id=obj.id)
-        if request.GET.get('recipes_limit'):
-            recipes_limit = int(request.GET.get('recipes_limit'))
-            queryset = author.recipes[:recipes_limit]
-        else:
-            queryset = author.recipes
-        return RecipeShortSerializer(queryset, many=True).data
+        """Рецепты автора, загруженные для всей страницы подписок"""
+
+        recipes = getattr(obj, 'short_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+        return RecipeShortSerializer(
+            recipes, many=True, context=self.context).data
@@ -1,10 +1,12 @@
 from http import HTTPStatus
 
-from django.shortcuts import get_list_or_404, get_object_or_404
+from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import permissions, viewsets
 from rest_framework.response import Response
 
+from api.pagination import SubscribePaginationClass
+from api.querysets import prefetch_short_recipes, subscriptions_queryset
 from users.models import CustomUser, Subscribe
 from .serializers import (CustomUserReadSerializer, UserRecordSerializer,
                           UserSetPasswordSerializer, SubscribeSerializer)
@@ -31,9 +33,20 @@ class SubscribeViewSet(viewsets.ModelViewSet):
 
     serializer_class = SubscribeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SubscribePaginationClass
 
     def get_queryset(self):
-        return get_list_or_404(CustomUser, following__user=self.request.user)
+        return subscriptions_queryset(self.request.user)
+
+    def paginate_queryset(self, queryset):
+        """Рецепты загружаются после пагинации, только для авторов страницы"""
+
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            recipes_limit = self.request.query_params.get('recipes_limit', '')
+            prefetch_short_recipes(
+                page, int(recipes_limit) if recipes_limit.isdigit() else None)
+        return page
 
     def create(self, request, *args, **kwargs):
         author_id = self.kwargs.get('user_id')